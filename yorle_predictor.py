@@ -1,9 +1,24 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime
+import bisect
 import json
+import logging
 import math
-from collections import Counter
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import closing
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
 
 # --- Configuración Inicial y Variables Globales ---
 st.set_page_config(
@@ -12,118 +27,1499 @@ st.set_page_config(
     layout="wide"
 )
 
+log = logging.getLogger(__name__)
+
 st.title("⚡ Cash winPredictor v9.0 - Motor Reactivo (Sorteo a Sorteo)")
 st.sidebar.header("📋 Navegación")
 
 franjas = ["mañana", "mediodía", "tarde", "noche", "madrugada"]
+NUMERO_MAX = 15  # los números sorteados van de 0 a NUMERO_MAX
 DATA_FILE = "resultados_guardados.json"
+# Diario de cambios: una línea JSON por alta y una lápida {"op": "del", ...} por borrado.
+JOURNAL_FILE = "resultados_guardados.jsonl"
+JOURNAL_COMPACTANDO = JOURNAL_FILE + ".compactando"
+SNAPSHOT_COMPACTADO = DATA_FILE + ".compactado"  # snapshot con JOURNAL_COMPACTANDO ya plegado, aún sin instalar
+JOURNAL_MAX_BYTES = 64 * 1024  # al superarlo se compacta en segundo plano
+# Motor de almacenamiento: "json" (snapshot + diario), "parquet" (particionado por año/mes),
+# "sqlite" o "binario" (registros de ancho fijo abiertos con np.memmap).
+MOTOR_DATOS = os.environ.get("CASHWIN_MOTOR", "json")
+PARQUET_DIR = "resultados_parquet"
+SQLITE_FILE = "resultados.sqlite3"
+BIN_FILE = "resultados.bin"
+VIDAS_MEDIAS = (5, 10, 25, 50)  # en sorteos; puntuaciones de recencia precalculadas para cada una
+VENTANAS_CORTO_PLAZO = range(3, 31)  # ventanas (días) de Corto Plazo que se calculan todas a la vez
+MEDIDAS_ROTACION = {"Media": "media", "Mediana": "mediana", "P90": "p90"}  # rotación sobre los huecos en días
 
 # --- Funciones de Datos ---
-def cargar_datos():
+@st.cache_resource
+def _locks_datos():
+    # Compartidos entre reruns y sesiones: uno para escribir en el diario y otro para la compactación.
+    return threading.Lock(), threading.Lock()
+
+def _normalizar_registro(record):
+    if 'fecha' in record: record['fecha'] = str(record['fecha']).split('T')[0]
+    return record
+
+def _leer_snapshot():
+    # Sin JOURNAL_COMPACTANDO, un SNAPSHOT_COMPACTADO es una compactación completa que no llegó a instalarse
+    # (se escribe entero antes de borrar el diario plegado) y es el snapshot vigente.
+    rutas = (DATA_FILE,) if os.path.exists(JOURNAL_COMPACTANDO) else (SNAPSHOT_COMPACTADO, DATA_FILE)
+    for ruta in rutas:
+        try:
+            with open(ruta, 'r') as f: return [_normalizar_registro(r) for r in json.load(f)]
+        except FileNotFoundError: continue
+        except json.JSONDecodeError: return []
+    return []
+
+def _reproducir_journal(data, ruta):
     try:
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-            for record in data:
-                if 'fecha' in record: record['fecha'] = str(record['fecha']).split('T')[0]
-            return data
-    except (FileNotFoundError, json.JSONDecodeError): return []
+        with open(ruta, 'r') as f: lineas = f.readlines()
+    except FileNotFoundError: return data
+    for linea in lineas:
+        try: entrada = json.loads(linea)
+        except json.JSONDecodeError: continue  # línea a medio escribir
+        if entrada.pop('op', 'add') != 'del':
+            data.append(_normalizar_registro(entrada)); continue
+        i = entrada.pop('i', None)
+        registro = _normalizar_registro(entrada)
+        if i is not None and 0 <= i < len(data) and data[i] == registro: del data[i]
+        elif registro in data: data.remove(registro)
+    return data
+
+def _cargar_datos_json():
+    data = _leer_snapshot()
+    for ruta in (JOURNAL_COMPACTANDO, JOURNAL_FILE): data = _reproducir_journal(data, ruta)
+    return data
+
+def cargar_datos():
+    # El histórico completo como DrawHistory; los motores tipados no pasan por diccionarios.
+    if MOTOR_DATOS == "parquet": return _cargar_datos_parquet()
+    if MOTOR_DATOS == "sqlite": return _cargar_datos_sqlite()
+    if MOTOR_DATOS == "binario": return DrawHistory.from_sorteos(mapear_sorteos())
+    return DrawHistory.from_records(_cargar_datos_json())
+
+def _escribir_snapshot(datos, ruta=DATA_FILE):
+    # Registro a registro (mismo formato que json.dump(datos, indent=4)): acepta un DrawHistory sin
+    # materializar la lista de diccionarios.
+    tmp = ruta + ".tmp"
+    with open(tmp, 'w') as f:
+        separador = "["
+        for r in datos:
+            f.write(separador + "\n    " + json.dumps(dict(r), indent=4).replace("\n", "\n    "))
+            separador = ","
+        f.write("[]" if separador == "[" else "\n]")
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, ruta)
 
 def guardar_datos(datos):
-    with open(DATA_FILE, 'w') as f: json.dump(datos, f, indent=4)
+    # Reescritura completa (p. ej. carga masiva): deja el diario vacío.
+    lock_journal, lock_compactacion = _locks_datos()
+    if MOTOR_DATOS == "parquet":
+        with lock_journal: guardar_parquet(datos)
+        return
+    if MOTOR_DATOS == "sqlite": return guardar_sqlite(datos)
+    if MOTOR_DATOS == "binario":
+        with lock_journal: guardar_binario(datos)
+        return
+    with lock_compactacion, lock_journal:
+        _escribir_snapshot(datos)
+        for ruta in (SNAPSHOT_COMPACTADO, JOURNAL_COMPACTANDO, JOURNAL_FILE):
+            if os.path.exists(ruta): os.remove(ruta)
+
+def _append_journal(entrada):
+    lock_journal, _ = _locks_datos()
+    with lock_journal:
+        with open(JOURNAL_FILE, 'a') as f: f.write(json.dumps(entrada) + "\n")
+        tamano = os.path.getsize(JOURNAL_FILE)
+    if tamano > JOURNAL_MAX_BYTES: threading.Thread(target=compactar_journal, daemon=True).start()
+
+def registrar_resultado(resultado):
+    if MOTOR_DATOS == "parquet": _modificar_particion(resultado, lambda regs: regs.append(resultado))
+    elif MOTOR_DATOS == "sqlite": upsert_sqlite(resultado)
+    elif MOTOR_DATOS == "binario": agregar_binario(resultado)
+    else: _append_journal(resultado)
+
+def registrar_borrado(indice, resultado):
+    if MOTOR_DATOS == "parquet": _modificar_particion(resultado, lambda regs: resultado in regs and regs.remove(resultado))
+    elif MOTOR_DATOS == "sqlite": borrar_sqlite(resultado)
+    elif MOTOR_DATOS == "binario": borrar_binario(resultado)
+    else: _append_journal({"op": "del", "i": indice, **resultado})
+
+def leer_cola_journal(desde):
+    # Entradas completas escritas a partir del byte `desde`: ([(op, registro)], bytes consumidos).
+    with open(JOURNAL_FILE, 'rb') as f:
+        f.seek(desde); datos = f.read()
+    completo = datos[:datos.rfind(b"\n") + 1]
+    entradas = []
+    for linea in completo.decode("utf-8").splitlines():
+        try: entrada = json.loads(linea)
+        except json.JSONDecodeError: continue
+        op = entrada.pop('op', 'add'); entrada.pop('i', None)
+        entradas.append((op, _normalizar_registro(entrada)))
+    return entradas, len(completo)
+
+def compactar_journal():
+    lock_journal, lock_compactacion = _locks_datos()
+    if not lock_compactacion.acquire(blocking=False): return  # ya hay una compactación en curso
+    try:
+        # Las altas nuevas siguen entrando en un diario vacío mientras se reescribe el snapshot.
+        with lock_journal:
+            if not os.path.exists(JOURNAL_COMPACTANDO):
+                # Compactación anterior interrumpida entre borrar el diario plegado e instalar el snapshot.
+                if os.path.exists(SNAPSHOT_COMPACTADO): os.replace(SNAPSHOT_COMPACTADO, DATA_FILE)
+                if not os.path.exists(JOURNAL_FILE): return
+                os.replace(JOURNAL_FILE, JOURNAL_COMPACTANDO)
+        # Orden seguro ante una parada en cualquier punto: mientras exista JOURNAL_COMPACTANDO vale el
+        # snapshot anterior más ese diario; al borrarlo pasa a valer SNAPSHOT_COMPACTADO, ya completo en disco.
+        _escribir_snapshot(_reproducir_journal(_leer_snapshot(), JOURNAL_COMPACTANDO), SNAPSHOT_COMPACTADO)
+        os.remove(JOURNAL_COMPACTANDO)
+        os.replace(SNAPSHOT_COMPACTADO, DATA_FILE)
+    finally: lock_compactacion.release()
+
+# --- Almacén Parquet ---
+# Columnas tipadas (fecha date32, código de franja y número uint8), un fichero por anio=AAAA/mes=M.
+_ESQUEMA_PARQUET = pa.schema([("fecha", pa.date32()), ("franja", pa.uint8()), ("numero", pa.uint8())])
+_PARTICION_PARQUET = ds.partitioning(pa.schema([("anio", pa.int16()), ("mes", pa.int8())]), flavor="hive")
+
+def _tabla_parquet(registros):
+    return pa.table({
+        "fecha": pa.array([datetime.strptime(r['fecha'], "%Y-%m-%d").date() for r in registros], pa.date32()),
+        "franja": pa.array([franjas.index(r['franja']) for r in registros], pa.uint8()),
+        "numero": pa.array([int(r['numero']) for r in registros], pa.uint8()),
+    }, schema=_ESQUEMA_PARQUET)
+
+def _tabla_sorteos(sorteos):
+    # Directa desde los arrays de sorteos (día ordinal, código de franja, número), sin diccionarios.
+    return pa.table({
+        "fecha": pa.array(sorteos["dia"].astype(np.int32) - _ORDINAL_EPOCH, pa.int32()).cast(pa.date32()),
+        "franja": pa.array(sorteos["franja"], pa.uint8()),
+        "numero": pa.array(sorteos["numero"], pa.uint8()),
+    }, schema=_ESQUEMA_PARQUET)
+
+def _registros_parquet(tabla):
+    columnas = tabla.to_pydict()
+    return [{"fecha": f.strftime("%Y-%m-%d"), "franja": franjas[c], "numero": n}
+            for f, c, n in zip(columnas["fecha"], columnas["franja"], columnas["numero"])]
+
+def _ruta_particion(fecha):
+    return os.path.join(PARQUET_DIR, f"anio={int(fecha[:4])}", f"mes={int(fecha[5:7])}", "part-0.parquet")
+
+def _escribir_particion(ruta, registros):
+    if not len(registros):
+        if os.path.exists(ruta): os.remove(ruta)
+        return
+    tabla = (registros if isinstance(registros, pa.Table) else _tabla_parquet(registros)).sort_by([("fecha", "ascending"), ("franja", "ascending")])
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    # El temporal empieza por "." para que ds.dataset lo ignore mientras se escribe.
+    tmp = os.path.join(os.path.dirname(ruta), "." + os.path.basename(ruta) + ".tmp")
+    pq.write_table(tabla, tmp)
+    os.replace(tmp, ruta)
+
+def guardar_parquet(datos):
+    # datos: lista de registros o DrawHistory (sus arrays pasan a la tabla tal cual).
+    tabla = _tabla_sorteos(datos.sorteos()) if isinstance(datos, DrawHistory) else _tabla_parquet(datos)
+    meses = pc.add(pc.multiply(pc.year(tabla.column("fecha")), 100), pc.month(tabla.column("fecha"))).to_numpy()
+    # Sin borrar antes el directorio: cada mes se sustituye de una vez y luego se quitan los que sobran,
+    # así que otro proceso que lea a la vez no se encuentra el almacén vacío ni ficheros que desaparecen.
+    escritas = set()
+    for mes in np.unique(meses).tolist():
+        ruta = _ruta_particion(f"{mes // 100:04d}-{mes % 100:02d}")
+        _escribir_particion(ruta, tabla.filter(meses == mes))
+        escritas.add(ruta)
+    for directorio, _, ficheros in os.walk(PARQUET_DIR):
+        for fichero in ficheros:
+            if not fichero.startswith(".") and os.path.join(directorio, fichero) not in escritas: os.remove(os.path.join(directorio, fichero))
+
+def _modificar_particion(resultado, cambio):
+    # Un alta o un borrado solo reescribe el mes afectado.
+    lock_journal, _ = _locks_datos()
+    ruta = _ruta_particion(resultado['fecha'])
+    with lock_journal:
+        registros = _registros_parquet(pq.ParquetFile(ruta).read()) if os.path.exists(ruta) else []
+        cambio(registros)
+        _escribir_particion(ruta, registros)
+
+def _cargar_datos_parquet():
+    if not os.path.isdir(PARQUET_DIR) and os.path.exists(DATA_FILE):
+        # Primera ejecución con el motor Parquet: se migra el histórico JSON existente.
+        guardar_parquet(_cargar_datos_json())
+    if not os.path.isdir(PARQUET_DIR): return DrawHistory.vacio()
+    dataset = ds.dataset(PARQUET_DIR, format="parquet", partitioning=_PARTICION_PARQUET)
+    tabla = dataset.to_table(columns=["fecha", "franja", "numero"]).sort_by([("fecha", "ascending"), ("franja", "ascending")])
+    # Columnas tipadas a arrays: date32 es días desde 1970, así que el día ordinal es una suma.
+    sorteos = np.empty(tabla.num_rows, SORTEO_DTYPE)
+    sorteos["dia"] = pc.cast(tabla.column("fecha"), pa.int32()).to_numpy() + _ORDINAL_EPOCH
+    sorteos["franja"], sorteos["numero"] = tabla.column("franja").to_numpy(), tabla.column("numero").to_numpy()
+    return DrawHistory.from_sorteos(sorteos)
+
+# --- Almacén SQLite ---
+# Índice único (fecha, franja): un solo número por sorteo y altas/bajas O(log n).
+# Índice (numero, fecha): las consultas por número no recorren la tabla.
+_ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS sorteos (fecha TEXT NOT NULL, franja INTEGER NOT NULL, numero INTEGER NOT NULL);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sorteos_fecha_franja ON sorteos (fecha, franja);
+CREATE INDEX IF NOT EXISTS ix_sorteos_numero ON sorteos (numero, fecha);
+"""
+_UPSERT_SQLITE = "INSERT INTO sorteos (fecha, franja, numero) VALUES (?, ?, ?) ON CONFLICT (fecha, franja) DO UPDATE SET numero = excluded.numero"
+
+def _conexion_sqlite():
+    nueva = not os.path.exists(SQLITE_FILE)
+    con = sqlite3.connect(SQLITE_FILE)
+    con.executescript(_ESQUEMA_SQLITE)
+    if nueva and os.path.exists(DATA_FILE):
+        # Primera ejecución con el motor SQLite: se migra el histórico JSON existente.
+        with con: con.executemany(_UPSERT_SQLITE, [_fila_sqlite(r) for r in _cargar_datos_json()])
+    return con
+
+def _fila_sqlite(r):
+    return (r['fecha'], franjas.index(r['franja']), int(r['numero']))
+
+def _cargar_datos_sqlite():
+    # SQLite da el día ordinal (julianday - 1721424.5), así que las filas van directas a un array tipado.
+    with closing(_conexion_sqlite()) as con:
+        filas = con.execute("SELECT CAST(julianday(fecha) - 1721424.5 AS INTEGER), franja, numero FROM sorteos "
+                            "WHERE julianday(fecha) IS NOT NULL ORDER BY fecha, franja").fetchall()
+    return DrawHistory.from_sorteos(np.array(filas, SORTEO_DTYPE))
+
+def guardar_sqlite(datos):
+    with closing(_conexion_sqlite()) as con, con:
+        con.execute("DELETE FROM sorteos")
+        con.executemany(_UPSERT_SQLITE, (_fila_sqlite(r) for r in datos))
+
+def upsert_sqlite(resultado):
+    with closing(_conexion_sqlite()) as con, con: con.execute(_UPSERT_SQLITE, _fila_sqlite(resultado))
+
+def borrar_sqlite(resultado):
+    with closing(_conexion_sqlite()) as con, con:
+        con.execute("DELETE FROM sorteos WHERE fecha = ? AND franja = ?", _fila_sqlite(resultado)[:2])
+
+# --- Almacén binario (memmap) ---
+# Registros de ancho fijo (6 bytes) ordenados por sorteo: día ordinal int32, código de franja y número uint8.
+# Se abre con np.memmap: todas las sesiones y procesos comparten las mismas páginas de la caché del SO,
+# y las estrategias trabajan directamente sobre estos arrays.
+SORTEO_DTYPE = np.dtype([("dia", "<i4"), ("franja", "u1"), ("numero", "u1")])
+_ORDINAL_EPOCH = datetime(1970, 1, 1).toordinal()
+
+# Índice global de sorteo: día ordinal × 5 + posición de la franja. Ordenar, cortar el histórico en un
+# sorteo o pasar al siguiente son operaciones con enteros. En memoria se guarda junto a cada registro.
+SORTEO_INDEXADO_DTYPE = np.dtype(SORTEO_DTYPE.descr + [("slot", "<i4")])
+
+def _slot(dia, franja_codigo):
+    return dia * len(franjas) + franja_codigo
+
+def _slots(sorteos):
+    if "slot" in sorteos.dtype.names: return sorteos["slot"]
+    return _slot(sorteos["dia"].astype(np.int64), sorteos["franja"])
+
+def _dias_ordinales(fechas):
+    return pd.to_datetime(fechas).to_numpy().astype("datetime64[D]").astype(np.int64) + _ORDINAL_EPOCH
+
+def _a_sorteos(historico):
+    # DataFrame -> array de SORTEO_DTYPE. Un array (p. ej. el memmap) se devuelve tal cual, sin copiar.
+    if isinstance(historico, np.ndarray): return historico
+    if isinstance(historico, DrawHistory): return historico.sorteos()
+    sorteos = np.zeros(len(historico), SORTEO_DTYPE)
+    if len(historico) == 0: return sorteos
+    sorteos["dia"] = historico["dia"] if "dia" in historico else _dias_ordinales(historico["fecha"])
+    if "franja" in historico: sorteos["franja"] = pd.Categorical(historico["franja"], categories=franjas).codes
+    sorteos["numero"] = historico["numero"]
+    return sorteos
+
+def _orden_descendente(valores):
+    # Mismo orden, empates incluidos, que Series.sort_values(ascending=False) de pandas.
+    return (len(valores) - 1 - valores[::-1].argsort(kind="quicksort"))[::-1]
+
+def _orden_cronologico(sorteos):
+    clave = _slots(sorteos)
+    if np.all(clave[1:] >= clave[:-1]): return np.arange(len(sorteos))  # ya en orden: no se ordena nada
+    return np.argsort(clave, kind="stable")
+
+def _sorteo_binario(resultado):
+    dia = datetime.strptime(resultado['fecha'], "%Y-%m-%d").toordinal()
+    return np.array([(dia, franjas.index(resultado['franja']), int(resultado['numero']))], SORTEO_DTYPE)
+
+def _registros_binario(sorteos):
+    return [{"fecha": datetime.fromordinal(d).strftime("%Y-%m-%d"), "franja": franjas[c], "numero": n}
+            for d, c, n in zip(sorteos["dia"].tolist(), sorteos["franja"].tolist(), sorteos["numero"].tolist())]
+
+def _escribir_binario(sorteos):
+    sorteos.tofile(BIN_FILE + ".tmp")
+    os.replace(BIN_FILE + ".tmp", BIN_FILE)
+
+def guardar_binario(datos):
+    if isinstance(datos, DrawHistory):
+        sorteos = np.empty(len(datos), SORTEO_DTYPE)
+        sorteos["dia"], sorteos["franja"] = np.divmod(np.sort(datos.slot), len(franjas))
+        sorteos["numero"] = datos.numero[np.argsort(datos.slot, kind="stable")]
+        return _escribir_binario(sorteos)
+    sorteos = _a_sorteos(pd.DataFrame(datos, columns=["fecha", "franja", "numero"]))
+    _escribir_binario(sorteos[_orden_cronologico(sorteos)])
+
+def _leer_binario():
+    return np.fromfile(BIN_FILE, SORTEO_DTYPE) if os.path.exists(BIN_FILE) else np.zeros(0, SORTEO_DTYPE)
+
+def agregar_binario(resultado):
+    nuevo = _sorteo_binario(resultado)
+    lock_journal, _ = _locks_datos()
+    with lock_journal:
+        tamano = os.path.getsize(BIN_FILE) if os.path.exists(BIN_FILE) else 0
+        ultimo = np.fromfile(BIN_FILE, SORTEO_DTYPE, count=1, offset=tamano - SORTEO_DTYPE.itemsize) if tamano else None
+        if ultimo is None or _slots(ultimo)[0] < _slots(nuevo)[0]:
+            # Caso habitual: el sorteo nuevo es el más reciente y basta con añadir 6 bytes al final.
+            with open(BIN_FILE, "ab") as f: f.write(nuevo.tobytes())
+            return
+        sorteos = _leer_binario()
+        pos = np.searchsorted(_slots(sorteos), int(_slots(nuevo)[0]), side="right")
+        _escribir_binario(np.insert(sorteos, pos, nuevo))
+
+def borrar_binario(resultado):
+    objetivo = _sorteo_binario(resultado)[0]
+    lock_journal, _ = _locks_datos()
+    with lock_journal:
+        sorteos = _leer_binario()
+        coincidencias = np.flatnonzero(sorteos == objetivo)
+        if len(coincidencias): _escribir_binario(np.delete(sorteos, coincidencias[0]))
+
+def leer_cola_binario(desde):
+    with open(BIN_FILE, 'rb') as f:
+        f.seek(desde); datos = f.read()
+    completos = len(datos) // SORTEO_DTYPE.itemsize * SORTEO_DTYPE.itemsize
+    return [("add", r) for r in _registros_binario(np.frombuffer(datos[:completos], SORTEO_DTYPE))], completos
+
+@st.cache_resource(max_entries=2)
+def _memmap_binario(version):
+    # Un mapa por versión del fichero (mtime, tamaño); el anterior sigue siendo válido para quien lo esté usando.
+    return np.memmap(BIN_FILE, dtype=SORTEO_DTYPE, mode="r", shape=(version[1] // SORTEO_DTYPE.itemsize,))
+
+def mapear_sorteos_versionado():
+    # (versión del fichero, sorteos); la versión sirve de clave para las cachés derivadas del mapa.
+    if not os.path.exists(BIN_FILE) and os.path.exists(DATA_FILE):
+        # Primera ejecución con el motor binario: se migra el histórico JSON existente.
+        guardar_binario(_cargar_datos_json())
+    if not os.path.exists(BIN_FILE) or os.path.getsize(BIN_FILE) < SORTEO_DTYPE.itemsize: return None, np.zeros(0, SORTEO_DTYPE)
+    estado = os.stat(BIN_FILE)
+    version = (estado.st_mtime_ns, estado.st_size)
+    return ("binario",) + version, _memmap_binario(version)
+
+def mapear_sorteos():
+    return mapear_sorteos_versionado()[1]
+
+# --- Histórico compacto en arrays ---
+# Un sorteo ocupa 5 bytes (índice global de sorteo int32 y número uint8) repartidos en dos arrays, en vez
+# de un dict con dos cadenas por registro. Los históricos no se modifican: append/delete devuelven uno nuevo.
+class DrawRecord:
+    # Vista de un sorteo para la interfaz; se lee como el dict {"fecha", "franja", "numero"} de siempre.
+    __slots__ = ("dia", "franja_codigo", "numero")
+
+    def __init__(self, dia, franja_codigo, numero):
+        self.dia, self.franja_codigo, self.numero = dia, franja_codigo, numero
+
+    @classmethod
+    def desde(cls, registro):
+        if isinstance(registro, DrawRecord): return registro
+        dia = datetime.strptime(str(registro["fecha"])[:10], "%Y-%m-%d").toordinal()
+        numero = int(registro["numero"])
+        if not 0 <= numero <= NUMERO_MAX: raise ValueError(f"número fuera de rango: {numero}")
+        return cls(dia, franjas.index(registro["franja"]), numero)
+
+    @property
+    def slot(self): return _slot(self.dia, self.franja_codigo)
+
+    @property
+    def fecha(self): return datetime.fromordinal(self.dia).strftime("%Y-%m-%d")
+
+    @property
+    def franja(self): return franjas[self.franja_codigo]
+
+    def keys(self): return ("fecha", "franja", "numero")
+
+    def __getitem__(self, clave):
+        if clave not in ("fecha", "franja", "numero"): raise KeyError(clave)
+        return getattr(self, clave)
+
+    def __eq__(self, otro):
+        if isinstance(otro, DrawRecord): return (self.dia, self.franja_codigo, self.numero) == (otro.dia, otro.franja_codigo, otro.numero)
+        try: return (self.fecha, self.franja, self.numero) == (otro["fecha"], otro["franja"], otro["numero"])
+        except (KeyError, TypeError, IndexError): return NotImplemented
+
+    def __hash__(self): return hash((self.dia, self.franja_codigo, self.numero))
+
+    def __repr__(self): return f"DrawRecord(fecha={self.fecha!r}, franja={self.franja!r}, numero={self.numero})"
+
+class DrawHistory:
+    # Los arrays pueden tener más capacidad que `_n`; `_cola` (compartida por los históricos que usan el
+    # mismo buffer) guarda hasta dónde está escrito. append escribe en el hueco libre si nadie lo ha usado
+    # ya, así que añadir es O(1) amortizado y las versiones anteriores siguen viendo solo sus `_n` sorteos.
+    __slots__ = ("_slot", "_numero", "_n", "_cola")
+
+    def __init__(self, slot, numero, n=None, cola=None):
+        self._slot, self._numero = slot, numero
+        self._n = len(slot) if n is None else n
+        self._cola = [self._n] if cola is None else cola
+
+    @classmethod
+    def vacio(cls):
+        return cls(np.empty(0, np.int32), np.empty(0, np.uint8))
+
+    @classmethod
+    def from_records(cls, registros):
+        # Se valida como en el importador CSV: una fila con fecha ilegible, franja desconocida o número
+        # fuera de 0..NUMERO_MAX se descarta con un aviso (antes acababa en otro sorteo o en OverflowError).
+        if isinstance(registros, DrawHistory): return registros
+        registros = list(registros)
+        if not registros: return cls.vacio()
+        campo = lambda r, clave: r[clave] if clave in r.keys() else None
+        fechas = pd.to_datetime(pd.Series([str(campo(r, "fecha"))[:10] for r in registros]), format="%Y-%m-%d", errors="coerce")
+        codigos = pd.Categorical([campo(r, "franja") for r in registros], categories=franjas).codes
+        numeros = pd.to_numeric(pd.Series([campo(r, "numero") for r in registros], dtype=object), errors="coerce").to_numpy(np.float64)
+        valido = fechas.notna().to_numpy() & (codigos >= 0) & (numeros >= 0) & (numeros <= NUMERO_MAX) & (numeros == np.floor(numeros))
+        if not valido.all():
+            malos = np.flatnonzero(~valido)
+            log.warning("%d registros del histórico ignorados por no ser válidos; el primero: %r", len(malos), registros[malos[0]])
+        dias = fechas[valido].to_numpy().astype("datetime64[D]").astype(np.int64) + _ORDINAL_EPOCH
+        return cls(_slot(dias, codigos[valido]).astype(np.int32), numeros[valido].astype(np.uint8))
+
+    @classmethod
+    def from_sorteos(cls, sorteos):
+        return cls(np.array(_slots(sorteos), np.int32), np.array(sorteos["numero"], np.uint8))
+
+    @property
+    def slot(self): return self._slot[:self._n]
+
+    @property
+    def numero(self): return self._numero[:self._n]
+
+    @property
+    def dia(self): return self.slot // len(franjas)
+
+    @property
+    def franja(self): return (self.slot % len(franjas)).astype(np.uint8)
+
+    @property
+    def nbytes(self): return self._n * (self._slot.itemsize + self._numero.itemsize)
+
+    def __len__(self): return self._n
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            # Vista sin copia; su buffer queda "lleno", de modo que un append posterior copia.
+            return DrawHistory(self.slot[indice], self.numero[indice])
+        if indice < 0: indice += self._n
+        if not 0 <= indice < self._n: raise IndexError("DrawHistory index out of range")
+        return DrawRecord(*divmod(int(self._slot[indice]), len(franjas)), int(self._numero[indice]))
+
+    def __iter__(self):
+        for slot, numero in zip(self.slot.tolist(), self.numero.tolist()):
+            yield DrawRecord(*divmod(slot, len(franjas)), numero)
+
+    def __eq__(self, otro):
+        if not isinstance(otro, DrawHistory): return NotImplemented
+        return self._n == otro._n and np.array_equal(self.slot, otro.slot) and np.array_equal(self.numero, otro.numero)
+
+    def __contains__(self, registro): return self._posicion(registro) is not None
+
+    def __repr__(self): return f"DrawHistory({self._n} sorteos)"
+
+    def _posicion(self, registro):
+        r = DrawRecord.desde(registro)
+        i = np.flatnonzero((self.slot == r.slot) & (self.numero == r.numero))
+        return int(i[0]) if len(i) else None
+
+    def index(self, registro):
+        i = self._posicion(registro)
+        if i is None: raise ValueError(f"{registro!r} is not in DrawHistory")
+        return i
+
+    def find_slot(self, slot):
+        # Posición del sorteo con ese índice global, o None.
+        i = np.flatnonzero(self.slot == slot)
+        return int(i[0]) if len(i) else None
+
+    def extend(self, otro):
+        n, m = self._n, len(otro)
+        if self._cola[0] == n and n + m <= len(self._slot): slot, numero, cola = self._slot, self._numero, self._cola
+        else:
+            capacidad = max(16, 2 * (n + m))
+            slot, numero = np.empty(capacidad, np.int32), np.empty(capacidad, np.uint8)
+            slot[:n], numero[:n] = self.slot, self.numero
+            cola = [n]
+        slot[n:n + m], numero[n:n + m] = otro.slot, otro.numero
+        cola[0] = n + m
+        return DrawHistory(slot, numero, n + m, cola)
+
+    def append(self, registro):
+        r = DrawRecord.desde(registro)
+        return self.extend(DrawHistory(np.array([r.slot], np.int32), np.array([r.numero], np.uint8)))
+
+    def delete(self, indice):
+        return DrawHistory(np.delete(self.slot, indice), np.delete(self.numero, indice))
+
+    def sorteos(self):
+        # Copia en SORTEO_INDEXADO_DTYPE, el formato que consumen las estrategias.
+        sorteos = np.empty(self._n, SORTEO_INDEXADO_DTYPE)
+        sorteos["dia"], sorteos["franja"] = np.divmod(self.slot, len(franjas))
+        sorteos["numero"], sorteos["slot"] = self.numero, self.slot
+        return sorteos
+
+    def to_pandas(self):
+        # Sin copia: cada columna es una vista sobre su array (día = slot // 5, franja = slot % 5).
+        return pd.DataFrame({"slot": self.slot, "numero": self.numero}, copy=False)
+
+    def to_arrow(self):
+        return pa.table({"slot": pa.array(self.slot), "numero": pa.array(self.numero)})
+
+# --- Frecuencias por número sobre el eje de sorteos (Fenwick) ---
+# Un árbol de Fenwick por número indexado por el índice global de sorteo. El slot de un sorteo no depende
+# de los demás, así que dar de alta un día atrasado, borrar o corregir un número son actualizaciones
+# puntuales O(log n) y los conteos por tramo siguen siendo correctos sin reconstruir nada. Las columnas
+# (una por número) se actualizan y consultan a la vez. Es un camino lateral: solo lo leen las ventanas de
+# Corto Plazo de más de 30 días; el resto de estrategias usa el IndiceOcurrencias de la versión, que tras
+# una edición en mitad del histórico se reconstruye entero.
+class FrecuenciasFenwick:
+    __slots__ = ("version", "total", "_origen", "_tope", "_arbol")
+
+    def __init__(self, slots, numeros, version=None):
+        slots, numeros = np.asarray(slots, np.int64), np.asarray(numeros, np.int64)
+        self.version, self.total = version, len(slots)
+        origen = int(slots.min()) if len(slots) else 0
+        self._tope = int(slots.max()) + 1 if len(slots) else 0
+        columnas = max(NUMERO_MAX, int(numeros.max(initial=0))) + 1
+        self._construir(origen, max(64, 2 * (self._tope - origen)), columnas, slots, numeros)
+
+    @classmethod
+    def desde(cls, historial, version=None):
+        return cls(historial.slot, historial.numero, version)
+
+    def _construir(self, origen, capacidad, columnas, slots, numeros):
+        # En O(capacidad): el nodo i guarda la suma de los puntos (i - lowbit(i), i].
+        acumulados = np.zeros((capacidad + 1, columnas), np.int64)
+        np.add.at(acumulados, (slots - origen + 1, numeros), 1)
+        np.cumsum(acumulados, axis=0, out=acumulados)
+        i = np.arange(capacidad + 1)
+        self._origen, self._arbol = origen, (acumulados - acumulados[i - (i & -i)]).astype(np.int32)
+
+    def _prefijos(self, posiciones):
+        # Una fila por posición p: apariciones de cada número en los slots [origen, origen + p).
+        j = np.clip(np.asarray(posiciones, np.int64), 0, len(self._arbol) - 1)
+        total = np.zeros((len(j), self._arbol.shape[1]), np.int64)
+        while j.any():
+            total += self._arbol[j]
+            j = j - (j & -j)
+        return total
+
+    def _asegurar(self, slot, numero):
+        capacidad, columnas = len(self._arbol) - 1, self._arbol.shape[1]
+        if self._origen <= slot < self._origen + capacidad and numero < columnas: return
+        puntos = np.diff(self._prefijos(np.arange(capacidad + 1)), axis=0)
+        filas, cols = np.nonzero(puntos)
+        repeticiones = puntos[filas, cols]
+        slots = filas + self._origen
+        # Se dimensiona al rango real de slots (los sorteos que hay más el nuevo), no desde el origen
+        # anterior: un árbol vacío empieza en el primer slot insertado.
+        inicio, fin = min(int(slots.min(initial=slot)), slot), max(int(slots.max(initial=slot)), slot) + 1
+        origen = inicio - (fin - inicio) // 2 if len(slots) and slot < self._origen else inicio  # margen para seguir rellenando hacia atrás
+        self._construir(origen, max(64, 2 * (fin - origen)), max(columnas, numero + 1),
+                        np.repeat(slots, repeticiones), np.repeat(cols, repeticiones))
+
+    def sumar(self, slot, numero, delta):
+        self._asegurar(slot, numero)
+        i = slot - self._origen + 1
+        while i < len(self._arbol):
+            self._arbol[i, numero] += delta
+            i += i & -i
+        self.total += delta
+        self._tope = max(self._tope, slot + 1)
+
+    def conteos_entre_slots(self, slot_desde, slot_hasta):
+        desde, hasta = self._prefijos([slot_desde - self._origen, slot_hasta - self._origen])
+        return hasta - desde
+
+    def conteos_por_dia(self, dia_desde, corte=None):
+        # Mismo resultado que IndiceOcurrencias.conteos_por_dia; el árbol cubre siempre el histórico entero.
+        if corte is not None and corte != self.total: raise ValueError("FrecuenciasFenwick only covers the whole history")
+        dia_inicio, dia_fin = max(dia_desde, self._origen // len(franjas)), -(-self._tope // len(franjas))
+        if dia_inicio >= dia_fin: return np.empty(0, np.int64), np.zeros((0, self._arbol.shape[1]), np.int64)
+        filas = np.diff(self._prefijos(_slot(np.arange(dia_inicio, dia_fin + 1), 0) - self._origen), axis=0)
+        con_sorteos = filas.any(axis=1)
+        return np.arange(dia_inicio, dia_fin)[con_sorteos], filas[con_sorteos]
+
+    def copia(self):
+        copia = FrecuenciasFenwick.__new__(FrecuenciasFenwick)
+        copia.version, copia.total, copia._origen, copia._tope = self.version, self.total, self._origen, self._tope
+        copia._arbol = self._arbol.copy()
+        return copia
+
+# --- Histórico compartido por proceso ---
+# Todas las sesiones leen la misma instantánea inmutable (version, registros: DrawHistory). Las escrituras persisten
+# el cambio y publican una versión nueva que comparte los registros de la anterior (copy-on-write).
+# Si la versión solo añade sorteos a la anterior, `base` es la versión previa y `agregados` los registros
+# nuevos, de modo que las estructuras derivadas pueden ampliarse en lugar de reconstruirse.
+Instantanea = namedtuple("Instantanea", ["version", "registros", "base", "agregados"])
 
-if "resultados" not in st.session_state: st.session_state.resultados = cargar_datos()
+def _firma(ruta):
+    try: estado = os.stat(ruta)
+    except FileNotFoundError: return None
+    return (estado.st_ino, estado.st_size, estado.st_mtime_ns)
+
+def _ruta_cola():
+    # Fichero del almacén al que solo se añade por el final y del que puede leerse únicamente la cola.
+    return {"json": JOURNAL_FILE, "binario": BIN_FILE}.get(MOTOR_DATOS)
+
+def _firmas_almacen():
+    if MOTOR_DATOS == "parquet": rutas = [os.path.join(d, f) for d, _, fs in os.walk(PARQUET_DIR) for f in fs if not f.startswith(".")]
+    elif MOTOR_DATOS == "sqlite": rutas = [SQLITE_FILE]
+    elif MOTOR_DATOS == "binario": rutas = [BIN_FILE]
+    else: rutas = [DATA_FILE, SNAPSHOT_COMPACTADO, JOURNAL_COMPACTANDO, JOURNAL_FILE]
+    firmas = {ruta: _firma(ruta) for ruta in rutas}
+    cola = _ruta_cola()
+    if firmas.get(cola): firmas[cola] = firmas[cola][:2]  # (inodo, bytes leídos)
+    return firmas
+
+class HistorialCompartido:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leido = _firmas_almacen()
+        self.actual = Instantanea(0, cargar_datos(), None, DrawHistory.vacio())
+        self._frecuencias = FrecuenciasFenwick.desde(self.actual.registros, 0)
+
+    def _publicar(self, registros, agregados=None, cambios=None):
+        # cambios: [(slot, numero, +1/-1)] para actualizar el árbol de frecuencias; None lo reconstruye.
+        previa = self.actual
+        self.actual = Instantanea(previa.version + 1, registros, previa.version if agregados else None, agregados if agregados else DrawHistory.vacio())
+        if cambios is None: self._frecuencias = FrecuenciasFenwick.desde(registros, self.actual.version)
+        else:
+            # Copy-on-write, como los registros: el árbol de una versión publicada no vuelve a tocarse y
+            # los lectores lo usan sin copiarlo. Se copia una vez por escritura y no en cada rerun.
+            self._frecuencias = self._frecuencias.copia()
+            for slot, numero, delta in cambios: self._frecuencias.sumar(slot, numero, delta)
+            self._frecuencias.version = self.actual.version
+
+    def frecuencias(self, instantanea):
+        # Árbol de frecuencias (de solo lectura) si sigue en la versión de la instantánea; si no, None.
+        with self._lock:
+            return self._frecuencias if self._frecuencias.version == instantanea.version else None
+
+    def sincronizar(self):
+        # Incorpora lo que otros procesos hayan escrito en el almacén. Si lo único que ha cambiado es que
+        # el diario (o el fichero binario) ha crecido, solo se lee la cola nueva; si no, se recarga entero.
+        with self._lock:
+            firmas, cola = _firmas_almacen(), _ruta_cola()
+            actual = firmas.get(cola)
+            leida = self._leido.get(cola) or (actual and (actual[0], 0))
+            resto_igual = all(firmas.get(r) == self._leido.get(r) for r in set(firmas) | set(self._leido) if r != cola)
+            if resto_igual and actual == leida: return
+            if resto_igual and actual and leida and actual[0] == leida[0] and actual[1] > leida[1]:
+                entradas, consumidos = (leer_cola_journal if cola == JOURNAL_FILE else leer_cola_binario)(leida[1])
+                self._leido[cola] = (leida[0], leida[1] + consumidos)
+                self._aplicar(entradas)
+                return
+            registros = cargar_datos()
+            self._leido = firmas
+            if registros != self.actual.registros: self._publicar(registros)
+
+    def _marcar_escrito(self):
+        # Tras una escritura propia: las firmas nuevas del almacén pasan a "leídas" para que el vigilante no
+        # recargue ni publique otra versión. La cola se sigue leyendo desde donde iba (si es el mismo fichero):
+        # releer las entradas propias no publica nada y así no se pierde lo que otro proceso añada a la vez.
+        firmas, cola = _firmas_almacen(), _ruta_cola()
+        leida = self._leido.get(cola)
+        if firmas.get(cola) and leida and firmas[cola][0] == leida[0]: firmas[cola] = leida
+        self._leido = firmas
+
+    def _aplicar(self, entradas):
+        # Altas y lápidas leídas del almacén. Las que ya reflejan el estado actual (p. ej. las escritas
+        # por este mismo proceso) no cambian nada y no publican versión.
+        registros = previos = self.actual.registros
+        solo_altas, cambios = True, []
+        for op, r in entradas:
+            try: r = DrawRecord.desde(r)
+            except (KeyError, TypeError, ValueError, OverflowError) as e:
+                log.warning("Entrada del almacén ignorada (%s): %r", e, r); continue
+            i = registros.find_slot(r.slot)
+            if i is not None and ((op == "del") == (registros[i] == r)):
+                cambios.append((r.slot, registros[i].numero, -1))
+                registros = registros.delete(i); i = None; solo_altas = False
+            if op != "del" and i is None:
+                cambios.append((r.slot, r.numero, 1))
+                registros = registros.append(r)
+        if registros != previos: self._publicar(registros, registros[len(previos):] if solo_altas else None, cambios)
+
+    def agregar(self, resultado):
+        # Devuelve "existente", "corregido" o "agregado". Un sorteo (fecha, franja) solo admite un número.
+        with self._lock:
+            registros = self.actual.registros
+            nuevo = DrawRecord.desde(resultado)
+            existente = registros.find_slot(nuevo.slot)
+            if existente is not None and registros[existente] == nuevo: return "existente"
+            cambios = [(nuevo.slot, nuevo.numero, 1)]
+            if existente is not None:
+                registrar_borrado(existente, dict(registros[existente]))
+                cambios.append((nuevo.slot, registros[existente].numero, -1))
+                registros = registros.delete(existente)
+            registrar_resultado(dict(nuevo))
+            self._marcar_escrito()
+            registros = registros.append(nuevo)
+            self._publicar(registros, registros[-1:] if existente is None else None, cambios)
+            return "agregado" if existente is None else "corregido"
+
+    def borrar(self, indice, resultado):
+        with self._lock:
+            registros = self.actual.registros
+            # La sesión puede venir de una versión anterior: se localiza de nuevo el registro.
+            if not (indice < len(registros) and registros[indice] == resultado):
+                if resultado not in registros: return
+                indice = registros.index(resultado)
+            borrado = registros[indice]
+            registrar_borrado(indice, dict(borrado))
+            self._marcar_escrito()
+            self._publicar(registros.delete(indice), cambios=[(borrado.slot, borrado.numero, -1)])
+
+    def fusionar(self, sorteos):
+        # sorteos: DrawHistory con un número por slot (ver leer_csv_por_bloques). Devuelve (insertados, actualizados).
+        with self._lock:
+            registros = self.actual.registros
+            orden = np.argsort(registros.slot, kind="stable")
+            posicion = np.minimum(np.searchsorted(registros.slot[orden], sorteos.slot), max(len(orden) - 1, 0))
+            existe = registros.slot[orden][posicion] == sorteos.slot if len(orden) else np.zeros(len(sorteos), bool)
+            indices = orden[posicion[existe]]
+            cambia = registros.numero[indices] != sorteos.numero[existe]
+            actualizados = int(cambia.sum())
+            agregados = DrawHistory(sorteos.slot[~existe].copy(), sorteos.numero[~existe].copy())
+            if not (len(agregados) or actualizados): return 0, 0
+            if actualizados:
+                numeros = registros.numero.copy()
+                numeros[indices[cambia]] = sorteos.numero[existe][cambia]
+                registros = DrawHistory(registros.slot, numeros)
+            registros = registros.extend(agregados)
+            guardar_datos(registros)
+            self._leido = _firmas_almacen()
+            self._publicar(registros, agregados if not actualizados else None)
+            return len(agregados), actualizados
+
+def leer_csv_por_bloques(archivo, tamano_bloque=1 << 20):
+    # Lector en streaming (multihilo) de pyarrow: en memoria solo hay un bloque de filas a la vez.
+    # Cada bloque se valida y se reduce a arrays (slot, número) por separado y se funde con lo leído; la
+    # última fila de cada sorteo (fecha, franja) gana. Devuelve (DrawHistory ordenado por slot, filas rechazadas).
+    lector = pa_csv.open_csv(
+        archivo,
+        read_options=pa_csv.ReadOptions(block_size=tamano_bloque, use_threads=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["fecha", "franja", "numero"],
+            column_types={"fecha": pa.string(), "franja": pa.string(), "numero": pa.string()}))
+    slots, numeros, rechazados = np.empty(0, np.int32), np.empty(0, np.uint8), 0
+    for lote in lector:
+        fecha = pc.strptime(pc.utf8_slice_codeunits(pc.utf8_trim_whitespace(lote.column("fecha")), 0, 10), format="%Y-%m-%d", unit="s", error_is_null=True)
+        franja = pc.index_in(pc.utf8_trim_whitespace(lote.column("franja")), value_set=pa.array(franjas))
+        numero_txt = pc.utf8_trim_whitespace(lote.column("numero"))
+        es_entero = pc.match_substring_regex(numero_txt, r"^\d+(\.0*)?$")
+        numero = pc.cast(pc.cast(pc.if_else(es_entero, numero_txt, pa.scalar("-1")), pa.float64()), pa.int64())
+        valido = pc.fill_null(pc.and_(pc.and_(pc.is_valid(fecha), pc.is_valid(franja)), pc.and_(es_entero, pc.less_equal(numero, NUMERO_MAX))), False)
+        rechazados += lote.num_rows - pc.sum(valido).as_py() if lote.num_rows else 0
+        dias = pc.cast(pc.cast(pc.filter(fecha, valido), pa.date32()), pa.int32()).to_numpy(zero_copy_only=False) + _ORDINAL_EPOCH
+        codigos = pc.filter(franja, valido).to_numpy(zero_copy_only=False)
+        slots = np.concatenate([slots, _slot(dias, codigos).astype(np.int32)])
+        numeros = np.concatenate([numeros, pc.filter(numero, valido).to_numpy(zero_copy_only=False).astype(np.uint8)])
+        # Primera aparición de cada slot en el array invertido = última en el archivo.
+        slots, ultimas = np.unique(slots[::-1], return_index=True)
+        numeros = numeros[::-1][ultimas]
+    return DrawHistory(slots.astype(np.int32), numeros), rechazados
+
+@st.cache_resource
+def historial_compartido():
+    return HistorialCompartido()
+
+class _VigilanteDatos(FileSystemEventHandler):
+    # Cualquier cambio en el directorio de datos dispara una sincronización; si no afecta al almacén
+    # se queda en unas llamadas a os.stat.
+    def __init__(self, historial): self.historial = historial
+    def on_any_event(self, event):
+        if event.src_path.endswith(".tmp"): return
+        # Un error aquí mataría el hilo del observador y no se cargaría ningún cambio más.
+        try: self.historial.sincronizar()
+        except Exception: log.exception("Error al sincronizar el histórico con %s", event.src_path)
+
+@st.cache_resource
+def iniciar_vigilancia(_historial):
+    observador = Observer()
+    observador.schedule(_VigilanteDatos(_historial), os.path.abspath("."), recursive=MOTOR_DATOS == "parquet")
+    observador.daemon = True
+    observador.start()
+    return observador
+
+HISTORIAL = historial_compartido()
+iniciar_vigilancia(HISTORIAL)
 if "pesos" not in st.session_state: st.session_state.pesos = {}
 
+# --- Recencia con decaimiento exponencial ---
+# Una puntuación por número y vida media: en cada sorteo todas se multiplican por el factor 0.5 ** (1 / vida)
+# y la del número sorteado suma 1. Solo se guardan los números sorteados (uint8) y un punto de control,
+# vidas × números, cada `bloque` sorteos; la recencia en un corte es el punto anterior, decaído, más los
+# sorteos que faltan hasta el corte, un producto (vidas × bloque) @ (bloque × números). Unos 9 bytes por
+# sorteo con 64 de bloque. Como DrawHistory, los buffers tienen holgura y `_cola` (compartida) marca hasta
+# dónde están escritos: ampliada() escribe a continuación sin copiar si nadie lo ha hecho ya, y añadir un
+# sorteo cuesta O(1) amortizado más O(vidas × (bloque + números)) al cerrar cada bloque.
+class RecenciaExponencial:
+    __slots__ = ("vidas", "total", "_bloque", "_factores", "_numeros", "_puntos", "_cola")
+
+    def __init__(self, numeros, vidas_medias=VIDAS_MEDIAS, bloque=64):
+        numeros = np.asarray(numeros, np.int64)
+        self.vidas, self.total, self._bloque = tuple(vidas_medias), len(numeros), bloque
+        self._factores = 0.5 ** (1 / np.asarray(self.vidas, np.float64))
+        self._numeros = numeros.astype(np.uint8)
+        self._puntos = np.zeros((self.total // bloque + 1, len(self.vidas), max(NUMERO_MAX, int(numeros.max(initial=0))) + 1))
+        for punto in range(1, len(self._puntos)): self._puntos[punto] = self._avanzar(punto - 1, punto * bloque)
+        self._cola = [self.total]
+
+    def _avanzar(self, punto, corte):
+        # Puntuaciones (vidas × números) tras los primeros `corte` sorteos desde el punto de control `punto`:
+        # el sorteo que lleva k sorteos detrás pesa factor ** k.
+        numeros = self._numeros[punto * self._bloque:corte]
+        uno = np.zeros((len(numeros), self._puntos.shape[2]))
+        uno[np.arange(len(numeros)), numeros] = 1
+        pesos = self._factores[:, None] ** np.arange(len(numeros) - 1, -1, -1)
+        return self._puntos[punto] * (self._factores ** len(numeros))[:, None] + pesos @ uno
+
+    def ampliada(self, numeros):
+        copia = RecenciaExponencial.__new__(RecenciaExponencial)
+        copia.vidas, copia.total, copia._bloque, copia._factores = self.vidas, self.total, self._bloque, self._factores
+        if self._cola[0] == self.total: copia._numeros, copia._puntos, copia._cola = self._numeros, self._puntos, self._cola
+        else:
+            copia._numeros, copia._puntos = self._numeros[:self.total].copy(), self._puntos[:self.total // self._bloque + 1].copy()
+            copia._cola = [self.total]
+        for numero in np.asarray(numeros).tolist(): copia.agregar(numero)
+        return copia
+
+    def agregar(self, numero):
+        if numero >= self._puntos.shape[2]: raise ValueError(f"numero {numero} fuera de rango (0..{self._puntos.shape[2] - 1})")
+        if self.total >= len(self._numeros):  # crecimiento amortizado, como DrawHistory
+            self._numeros = np.concatenate([self._numeros, np.zeros(max(self._bloque, len(self._numeros)), np.uint8)])
+        self._numeros[self.total] = numero
+        self.total += 1
+        self._cola[0] = self.total
+        punto = self.total // self._bloque
+        if self.total % self._bloque == 0:
+            if punto >= len(self._puntos): self._puntos = np.concatenate([self._puntos, np.zeros_like(self._puntos)])
+            self._puntos[punto] = self._avanzar(punto - 1, self.total)
+
+    def puntuaciones(self, vida_media, corte=None):
+        # Recencia de cada número tras los primeros `corte` sorteos. Una vida media no precalculada se
+        # resuelve con una pasada ponderada sobre esos sorteos.
+        corte = self.total if corte is None else corte
+        if vida_media in self.vidas: return self._avanzar(corte // self._bloque, corte)[self.vidas.index(vida_media)]
+        pesos = 0.5 ** ((corte - 1 - np.arange(corte)) / vida_media)
+        return np.bincount(self._numeros[:corte], pesos, minlength=self._puntos.shape[2]).astype(np.float64)
+
+# --- Índice de apariciones por número ---
+# Para cada número, las posiciones (en orden cronológico) y los días de sus apariciones, más el número
+# acumulado de días distintos. Las consultas reciben `corte`, el número de sorteos iniciales que cuentan,
+# y se resuelven con una búsqueda binaria: el mismo índice sirve para cualquier paso del backtest.
+# Junto a las listas se guarda la matriz de conteos acumulados (sorteos + 1) × números, int32: la fila i
+# son las apariciones de cada número en los i primeros sorteos, así que las frecuencias de cualquier
+# tramo, para todos los números a la vez, son la resta de dos filas. Con la misma forma, la matriz de
+# últimas apariciones: la fila i es el slot en que salió por última vez cada número dentro de los i
+# primeros sorteos (-1 si aún no había salido), de modo que la sorpresa de todos los números en cualquier
+# corte es una resta. `recencia` es la RecenciaExponencial
+# del mismo orden; si se pasa la de un prefijo del histórico, solo se le añaden los sorteos que faltan.
+class IndiceOcurrencias:
+    __slots__ = ("total", "recencia", "_slots", "_acumulados", "_ultimos", "_primeras", "_posiciones", "_dias", "_distintos",
+                 "_inicios", "_dias_planos", "_distintos_planos")
+
+    def __init__(self, historico, recencia=None):
+        sorteos = _a_sorteos(historico)
+        orden = _orden_cronologico(sorteos)
+        numeros, dias = sorteos["numero"][orden], sorteos["dia"][orden].astype(np.int64)
+        self.total = len(sorteos)
+        self._slots = _slots(sorteos)[orden]
+        self._acumulados = np.zeros((self.total + 1, max(NUMERO_MAX, int(numeros.max(initial=0))) + 1), np.int32)
+        self._acumulados[np.arange(1, self.total + 1), numeros] = 1
+        np.cumsum(self._acumulados, axis=0, out=self._acumulados)
+        # Cada sorteo fija el último slot de su número; el resto se arrastra de la fila anterior (los slots crecen).
+        self._ultimos = np.full(self._acumulados.shape, -1, np.int32)
+        self._ultimos[np.arange(1, self.total + 1), numeros] = self._slots
+        np.maximum.accumulate(self._ultimos, axis=0, out=self._ultimos)
+        por_numero = np.argsort(numeros, kind="stable")
+        limites = np.searchsorted(numeros[por_numero], np.arange(self._acumulados.shape[1] + 1))
+        self._posiciones = [por_numero[a:b] for a, b in zip(limites[:-1], limites[1:])]
+        self._dias = [dias[p] for p in self._posiciones]
+        self._distintos = [np.cumsum(np.concatenate([[1], d[1:] != d[:-1]])) if len(d) else d for d in self._dias]
+        self._primeras = np.array([p[0] if len(p) else self.total for p in self._posiciones], np.int64)
+        # Las mismas listas concatenadas por número, para consultar todos los números a la vez.
+        self._inicios, self._dias_planos = limites[:-1], dias[por_numero]
+        self._distintos_planos = np.concatenate(self._distintos).astype(np.int64)
+        self.recencia = RecenciaExponencial(numeros) if recencia is None else recencia.ampliada(numeros[recencia.total:])
+
+    def posicion(self, slot, corte=None):
+        # Primer sorteo con índice global >= slot, sin pasar de `corte`.
+        corte = self.total if corte is None else corte
+        return min(int(np.searchsorted(self._slots, slot)), corte)
+
+    def conteos(self, desde, hasta):
+        # Apariciones de cada número en los sorteos [desde, hasta).
+        return self._acumulados[hasta] - self._acumulados[desde]
+
+    def conteos_entre_slots(self, slot_desde, slot_hasta, corte=None):
+        return self.conteos(self.posicion(slot_desde, corte), self.posicion(slot_hasta, corte))
+
+    def conteos_por_dia(self, dia_desde, corte=None):
+        # Días con sorteos desde dia_desde (dentro del corte) y una fila de apariciones por día.
+        corte = self.total if corte is None else corte
+        desde = self.posicion(_slot(dia_desde, 0), corte)
+        dias = self._slots[desde:corte] // len(franjas)
+        if not len(dias): return dias, np.zeros((0, self._acumulados.shape[1]), np.int32)
+        limites = np.concatenate([[0], np.flatnonzero(np.diff(dias)) + 1, [len(dias)]])
+        return dias[limites[:-1]], np.diff(self._acumulados[desde + limites], axis=0)
+
+    def apariciones(self, numero, corte=None):
+        if not 0 <= numero < self._acumulados.shape[1]: return 0
+        return int(self._acumulados[self.total if corte is None else corte, numero])
+
+    def orden_aparicion(self, corte=None):
+        # Números que han salido dentro del corte, en el orden de su primera aparición (como pd.unique).
+        presentes = np.flatnonzero(self._acumulados[self.total if corte is None else corte])
+        return presentes[np.argsort(self._primeras[presentes], kind="stable")]
+
+    def rotaciones(self, corte=None):
+        # rotacion() de todos los números (posición = número), NaN donde no hay dos días con apariciones.
+        k = self._acumulados[self.total if corte is None else corte].astype(np.int64)
+        rotacion = np.full(len(k), np.nan)
+        if not self.total: return rotacion
+        ultimo = np.minimum(self._inicios + np.maximum(k, 1) - 1, self.total - 1)
+        distintos = np.where(k > 0, self._distintos_planos[ultimo], 0)
+        primero = self._dias_planos[np.minimum(self._inicios, self.total - 1)]
+        np.divide(self._dias_planos[ultimo] - primero, distintos - 1, out=rotacion, where=distintos >= 2)
+        # round() de Python y no np.round, que redondea distinto los x.xx5 (3.275 -> 3.28 en vez de 3.27).
+        return np.array([round(r, 2) for r in rotacion.tolist()])
+
+    def ultimos_slots(self, corte=None):
+        return self._ultimos[self.total if corte is None else corte]
+
+    def sorpresas(self, dia_actual, corte=None):
+        # Días desde la última aparición de cada número; 100 si no ha salido.
+        ultimos = self.ultimos_slots(corte)
+        return np.where(ultimos >= 0, dia_actual - ultimos // len(franjas), 100)
+
+    def rotacion(self, numero, corte=None):
+        # Media de días entre apariciones, contando una vez cada día: (último - primero) / (días distintos - 1).
+        k = self.apariciones(numero, corte)
+        if not k or self._distintos[numero][k - 1] < 2: return None
+        dias = self._dias[numero]
+        return round(int(dias[k - 1] - dias[0]) / int(self._distintos[numero][k - 1] - 1), 2)
+
+# --- Histórico tipado por versión ---
+# Se construye una vez por versión del histórico: sorteos (día ordinal, código de franja, número uint8 e
+# índice global de sorteo) en orden cronológico y su índice de apariciones. Páginas y estrategias lo
+# usan en modo lectura, así que un rerun no vuelve a parsear ni a ordenar.
+HistorialTipado = namedtuple("HistorialTipado", ["version", "sorteos", "ocurrencias"])
+
+def _tipar(sorteos, recencia=None):
+    sorteos = sorteos[_orden_cronologico(sorteos)]
+    return sorteos, IndiceOcurrencias(sorteos, recencia)
+
+@st.cache_resource
+def _cache_tipado():
+    return threading.Lock(), OrderedDict()
+
+def historial_tipado(instantanea):
+    lock, cache = _cache_tipado()
+    with lock:
+        tipado = cache.get(instantanea.version)
+        if tipado is not None: return tipado
+        previo = cache.get(instantanea.base) if instantanea.base is not None else None
+        recencia = None
+        if previo is not None:
+            # Versión que solo añade sorteos: se tipan los nuevos y se reutiliza el resto.
+            agregados = instantanea.agregados.sorteos()
+            sorteos = np.concatenate([previo.sorteos, agregados])
+            # Si además van detrás del último sorteo, el orden no cambia y la recencia solo se amplía.
+            if not len(previo.sorteos) or _slots(agregados).min(initial=np.iinfo(np.int32).max) > _slots(previo.sorteos[-1:])[0]:
+                recencia = previo.ocurrencias.recencia
+        else: sorteos = instantanea.registros.sorteos()
+        tipado = HistorialTipado(instantanea.version, *_tipar(sorteos, recencia))
+        cache[instantanea.version] = tipado
+        while len(cache) > 4: cache.popitem(last=False)
+        return tipado
+
+@st.cache_resource(max_entries=2)
+def _indice_binario(version):
+    # Con el motor binario el índice va por versión del fichero, igual que el mapa: un rerun no lo reconstruye.
+    return IndiceOcurrencias(_memmap_binario(version[1:]))
+
+def historial_binario():
+    # (versión, sorteos del memmap, índice de apariciones).
+    version, sorteos = mapear_sorteos_versionado()
+    return version, sorteos, IndiceOcurrencias(sorteos) if version is None else _indice_binario(version)
+
 # --- Funciones de Lógica de Estrategias ---
-def calcular_rotacion(df, numero):
-    fechas = df[df["numero"] == numero]["fecha"].unique()
-    fechas = sorted(pd.to_datetime(fechas))
-    if len(fechas) < 2: return None
-    diferencias = [(fechas[i+1] - fechas[i]).days for i in range(len(fechas)-1)]
-    return round(sum(diferencias) / len(diferencias), 2) if diferencias else None
-
-def generar_prediccion_corto_plazo(df_historico, fecha_actual_str, ventana_dias, num_candidatos, tipo_ponderacion):
-    if df_historico.empty: return []
+# Las funciones que aceptan `indice` (un IndiceOcurrencias) suponen que df son los primeros len(df) sorteos,
+# en orden cronológico, del histórico sobre el que se construyó; así responden sin recorrer df.
+def calcular_rotacion(df, numero, indice=None):
+    if indice is not None: return indice.rotacion(numero, len(df))
+    sorteos = _a_sorteos(df)
+    dias = np.unique(sorteos["dia"][sorteos["numero"] == numero]).tolist()
+    if len(dias) < 2: return None
+    # Media de las diferencias entre días consecutivos = (último - primero) / (apariciones - 1)
+    return round((dias[-1] - dias[0]) / (len(dias) - 1), 2)
+
+# Con los conteos por día de la ventana más larga, una matriz de pesos ponderación × ventana × día da en
+# un solo producto las puntuaciones de Corto Plazo de todas las VENTANAS_CORTO_PLAZO con las dos
+# ponderaciones. Cambiar la ventana o la ponderación es leer una fila, y el backtest las evalúa todas.
+class PuntuacionesCortoPlazo:
+    PONDERACIONES = ("Exponencial", "Lineal")
+    __slots__ = ("puntuaciones", "presentes")
+
+    def __init__(self, indice, dia_actual, corte):
+        dias, conteos = indice.conteos_por_dia(dia_actual - VENTANAS_CORTO_PLAZO[-1], corte)
+        ventanas = np.asarray(VENTANAS_CORTO_PLAZO, np.int64)[:, None]
+        dias_pasados = dia_actual - dias.astype(np.int64)
+        dentro = dias_pasados <= ventanas
+        pesos = np.stack([np.ceil(1.5 ** (ventanas - dias_pasados)), np.maximum(1, (ventanas + 1) - dias_pasados)]) * dentro
+        self.puntuaciones = (pesos @ conteos).astype(np.int64)
+        self.presentes = (dentro.astype(np.int64) @ conteos) > 0
+
+    def candidatos(self, ventana_dias, tipo_ponderacion, num_candidatos):
+        fila = ventana_dias - VENTANAS_CORTO_PLAZO[0]
+        presentes = np.flatnonzero(self.presentes[fila])
+        puntuaciones = self.puntuaciones[self.PONDERACIONES.index(tipo_ponderacion), fila, presentes]
+        return presentes[_orden_descendente(puntuaciones)][:num_candidatos].tolist()
+
+@st.cache_resource
+def _cache_corto_plazo():
+    return threading.Lock(), OrderedDict()
+
+def puntuaciones_corto_plazo(indice, dia_actual, corte, version=None):
+    # Con `version` se guardan por (versión, día, corte): los reruns de la página de predicción no recalculan.
+    if version is None: return PuntuacionesCortoPlazo(indice, dia_actual, corte)
+    clave = (version, dia_actual, corte)
+    lock, cache = _cache_corto_plazo()
+    with lock:
+        puntuaciones = cache.get(clave)
+        if puntuaciones is not None:
+            cache.move_to_end(clave)
+            return puntuaciones
+    puntuaciones = PuntuacionesCortoPlazo(indice, dia_actual, corte)
+    with lock:
+        cache[clave] = puntuaciones
+        while len(cache) > 16: cache.popitem(last=False)
+    return puntuaciones
+
+def calcular_rotaciones(df, numeros, medida="Media", indice=None, version=None):
+    # Rotación de cada número de `numeros` (None si no hay dos días con apariciones). "Media" es
+    # calcular_rotacion; las demás medidas salen del índice de huecos entre días con apariciones.
+    if medida == "Media": return {n: calcular_rotacion(df, n, indice) for n in numeros}
+    valores = build_gap_index(_a_sorteos(df), version).estadisticas("dias")[MEDIDAS_ROTACION[medida]]
+    return {n: None if n >= len(valores) or np.isnan(valores[n]) else round(float(valores[n]), 2) for n in numeros}
+
+def generar_prediccion_corto_plazo(df_historico, fecha_actual_str, ventana_dias, num_candidatos, tipo_ponderacion, indice=None, vida_media=VIDAS_MEDIAS[1], version=None):
+    if len(df_historico) == 0: return []
     try:
-        df_historico_copy = df_historico.copy()
-        df_historico_copy["fecha_dt"] = pd.to_datetime(df_historico_copy["fecha"]).dt.date
-        fecha_actual = pd.to_datetime(fecha_actual_str).date()
-        hace_x_dias = fecha_actual - timedelta(days=ventana_dias)
+        dia_actual = pd.Timestamp(fecha_actual_str).toordinal()
+        if indice is None: indice = IndiceOcurrencias(df_historico)
     except Exception: return []
-    df_filtrado = df_historico_copy[df_historico_copy["fecha_dt"] >= hace_x_dias].copy()
-    if df_filtrado.empty: return []
+    if ventana_dias in VENTANAS_CORTO_PLAZO and tipo_ponderacion in PuntuacionesCortoPlazo.PONDERACIONES:
+        puntuaciones = puntuaciones_corto_plazo(indice, dia_actual, len(df_historico), version)
+        return puntuaciones.candidatos(ventana_dias, tipo_ponderacion, num_candidatos)
+    if tipo_ponderacion == 'Vida media':
+        # Sin ventana: recencia exponencial por sorteo, ya calculada en el índice para cada corte.
+        puntuaciones = indice.recencia.puntuaciones(vida_media, len(df_historico))
+        presentes = np.flatnonzero(puntuaciones)
+        return presentes[_orden_descendente(puntuaciones[presentes])][:num_candidatos].tolist()
+    # Un peso por día de la ventana aplicado a las apariciones de ese día (dos filas de la matriz acumulada).
+    dias, conteos = indice.conteos_por_dia(dia_actual - ventana_dias, len(df_historico))
+    if not len(dias): return []
+    dias_pasados = dia_actual - dias.astype(np.int64)
+    presentes = np.flatnonzero(conteos.sum(axis=0))
     if tipo_ponderacion == 'Exponencial':
-        def ponderacion(fecha):
-            dias_pasados = (fecha_actual - fecha).days
-            return math.ceil(1.5 ** (ventana_dias - dias_pasados))
+        exponentes = ventana_dias - dias_pasados
+        # Pesos ceil(1.5 ** k) exactos mientras la suma quepa en la mantisa (2 ** 53); si no, en escala
+        # logarítmica: 1.5 ** (k - k_max), con el peso mayor en 1, ordena igual y no desborda.
+        if exponentes.max() * math.log2(1.5) + math.log2(conteos.sum()) >= 53:
+            puntuaciones = (1.5 ** (exponentes - exponentes.max()) @ conteos)[presentes]
+            return presentes[_orden_descendente(puntuaciones)][:num_candidatos].tolist()
+        pesos = np.ceil(1.5 ** exponentes)
     else:
-        def ponderacion(fecha):
-            dias_pasados = (fecha_actual - fecha).days
-            return max(1, (ventana_dias + 1) - dias_pasados)
-    df_filtrado["peso"] = df_filtrado["fecha_dt"].apply(ponderacion)
-    puntuaciones = df_filtrado.groupby("numero")["peso"].sum()
-    return puntuaciones.sort_values(ascending=False).head(num_candidatos).index.tolist()
-
-def calcular_puntuacion_sorpresa(numero, df_historico, fecha_actual):
-    apariciones = df_historico[df_historico['numero'] == numero]
-    if apariciones.empty: return 100
-    ultima_aparicion = pd.to_datetime(apariciones['fecha']).max().date()
-    return (fecha_actual.date() - ultima_aparicion).days
-
-def calcular_puntuacion_consistencia(numero, df_historico):
-    total_sorteos = len(df_historico)
-    if total_sorteos == 0: return 0
-    return (len(df_historico[df_historico['numero'] == numero]) / total_sorteos) * 100
-
-def generar_prediccion_detective(df_historico, fecha_str, params):
-    fecha_actual = pd.to_datetime(fecha_str)
-    todos_los_numeros = df_historico['numero'].unique()
-    puntuaciones_finales = {}
-    if df_historico.empty: return []
-    puntuaciones_racha = generar_prediccion_corto_plazo(df_historico.copy(), fecha_str, 10, len(todos_los_numeros), 'Exponencial')
-    puntuaciones_racha_dict = {num: score for score, num in enumerate(reversed(puntuaciones_racha), 1)}
-    for numero in todos_los_numeros:
-        p_racha = puntuaciones_racha_dict.get(numero, 0)
-        p_sorpresa = calcular_puntuacion_sorpresa(numero, df_historico, fecha_actual)
-        p_consistencia = calcular_puntuacion_consistencia(numero, df_historico)
-        score = (p_racha * params.get('peso_racha', 1.0) +
-                 p_sorpresa * params.get('peso_sorpresa', 1.0) +
-                 p_consistencia * params.get('peso_consistencia', 1.0))
-        puntuaciones_finales[numero] = score
-    candidatos_ordenados = sorted(puntuaciones_finales, key=puntuaciones_finales.get, reverse=True)
-    return candidatos_ordenados[:params.get('numero_candidatos', 7)]
-
-@st.cache_data
-def build_affinity_map(_df):
-    affinity_map = {}
-    df_sorted = _df.sort_values(by=['fecha', 'franja_order']).reset_index(drop=True)
-    for i in range(len(df_sorted) - 1):
-        current_num = df_sorted.loc[i, 'numero']
-        next_num = df_sorted.loc[i + 1, 'numero']
-        if current_num not in affinity_map: affinity_map[current_num] = []
-        affinity_map[current_num].append(next_num)
-    for num, next_nums in affinity_map.items():
-        affinity_map[num] = Counter(next_nums)
-    return affinity_map
-
-def generar_prediccion_afinidad(df_historico, params):
+        pesos = np.maximum(1, (ventana_dias + 1) - dias_pasados).astype(np.float64)
+    puntuaciones = (pesos @ conteos)[presentes].astype(np.int64)
+    return presentes[_orden_descendente(puntuaciones)][:num_candidatos].tolist()
+
+def calcular_puntuaciones_sorpresa(df_historico, fecha_actual, indice=None):
+    # Días desde la última aparición de cada número (100 si no ha salido), todos a la vez (posición = número).
+    if indice is None: indice = IndiceOcurrencias(df_historico)
+    return indice.sorpresas(fecha_actual.toordinal(), len(df_historico))
+
+def generar_prediccion_detective(df_historico, fecha_str, params, indice=None):
+    # Racha, sorpresa y consistencia como vectores alineados por número, combinados en una sola expresión.
+    fecha_actual = pd.Timestamp(fecha_str)  # pd.to_datetime infiere el formato en cada llamada
+    if len(df_historico) == 0: return []
+    if indice is None:
+        df_historico = _a_sorteos(df_historico)
+        indice = IndiceOcurrencias(df_historico)  # una pasada para todos los números
+        todos_los_numeros = pd.unique(df_historico['numero']).astype(np.int64)
+    else: todos_los_numeros = indice.orden_aparicion(len(df_historico))
+    total = len(df_historico)
+    apariciones = indice.conteos(0, total)
+    racha = np.zeros(len(apariciones), np.int64)
+    puntuaciones_racha = generar_prediccion_corto_plazo(df_historico, fecha_actual, 10, len(todos_los_numeros), 'Exponencial', indice)
+    racha[puntuaciones_racha] = np.arange(len(puntuaciones_racha), 0, -1)
+    sorpresa = calcular_puntuaciones_sorpresa(df_historico, fecha_actual, indice)
+    consistencia = (apariciones / total) * 100
+    puntuaciones = (racha * params.get('peso_racha', 1.0) +
+                    sorpresa * params.get('peso_sorpresa', 1.0) +
+                    consistencia * params.get('peso_consistencia', 1.0))[todos_los_numeros]
+    # Estable, como sorted(..., reverse=True): los empates quedan en orden de primera aparición.
+    return todos_los_numeros[np.argsort(-puntuaciones, kind="stable")][:params.get('numero_candidatos', 7)].tolist()
+
+class TransicionesAfinidad:
+    # Tensor 5×K×K de transiciones entre sorteos consecutivos: conteos[f, a, b] = veces que b salió justo
+    # después de a en un sorteo de la franja f. La afinidad general suma las franjas; la afinidad por franja
+    # lee solo la de destino. primera[f, a, b] guarda la posición de la primera vez: los empates se
+    # resuelven por orden de aparición. Añadir un sorteo al final actualiza una sola celda.
+    __slots__ = ("conteos", "primera", "ultimo", "total")
+    _SIN_APARICION = np.iinfo(np.int64).max
+
+    def __init__(self, sorteos):
+        numeros, franjas_codigo = sorteos["numero"].astype(np.int64), sorteos["franja"].astype(np.int64)
+        columnas = max(NUMERO_MAX, int(numeros.max(initial=0))) + 1
+        self.conteos = np.zeros((len(franjas), columnas, columnas), np.int32)
+        self.primera = np.full((len(franjas), columnas, columnas), self._SIN_APARICION, np.int64)
+        pares = (franjas_codigo[1:], numeros[:-1], numeros[1:])
+        np.add.at(self.conteos, pares, 1)
+        np.minimum.at(self.primera, pares, np.arange(max(len(numeros) - 1, 0)))
+        self.ultimo = int(numeros[-1]) if len(numeros) else None
+        self.total = len(numeros)
+
+    def ampliada(self, sorteos):
+        # Copia con `sorteos` añadidos al final; la original no cambia.
+        copia = TransicionesAfinidad.__new__(TransicionesAfinidad)
+        copia.conteos, copia.primera, copia.ultimo, copia.total = self.conteos.copy(), self.primera.copy(), self.ultimo, self.total
+        for numero, franja in zip(sorteos["numero"].tolist(), sorteos["franja"].tolist()): copia.agregar(numero, franja)
+        return copia
+
+    def agregar(self, numero, franja):
+        if numero >= self.conteos.shape[1]:
+            crecer = ((0, 0), (0, numero + 1 - self.conteos.shape[1]), (0, numero + 1 - self.conteos.shape[1]))
+            self.conteos = np.pad(self.conteos, crecer)
+            self.primera = np.pad(self.primera, crecer, constant_values=self._SIN_APARICION)
+        if self.ultimo is not None:
+            self.conteos[franja, self.ultimo, numero] += 1
+            if self.primera[franja, self.ultimo, numero] == self._SIN_APARICION: self.primera[franja, self.ultimo, numero] = self.total - 1
+        self.ultimo, self.total = numero, self.total + 1
+
+    def seguidores(self, numero, umbral, cantidad, franja=None):
+        # Números que siguieron a `numero` (en la franja indicada, o en cualquiera) al menos `umbral` veces,
+        # de más a menos frecuentes.
+        if not 0 <= numero < self.conteos.shape[1]: return []
+        if franja is None: fila, primera = self.conteos[:, numero].sum(axis=0), self.primera[:, numero].min(axis=0)
+        else: fila, primera = self.conteos[franja, numero], self.primera[franja, numero]
+        candidatos = np.flatnonzero((fila > 0) & (fila >= umbral))
+        orden = np.lexsort((primera[candidatos], -fila[candidatos]))
+        return candidatos[orden][:cantidad].tolist()
+
+class TransicionesRetardo:
+    # Tensor L×K×K: conteos[l - 1, a, b] = veces que b salió l sorteos después de a. Se construye en una
+    # sola pasada sobre ventanas deslizantes del histórico (sin un bucle por retardo); añadir un sorteo
+    # suma una celda por retardo.
+    __slots__ = ("conteos", "recientes", "total")
+
+    def __init__(self, sorteos, profundidad):
+        numeros = sorteos["numero"].astype(np.int64)
+        columnas = max(NUMERO_MAX, int(numeros.max(initial=0))) + 1
+        # Relleno con un número ficticio (`columnas`) para que los últimos sorteos también abran ventana.
+        relleno = np.concatenate([numeros, np.full(profundidad + 1, columnas)])
+        ventanas = np.lib.stride_tricks.sliding_window_view(relleno, profundidad + 1)[:len(numeros)]
+        conteos = np.zeros((profundidad, columnas + 1, columnas + 1), np.int32)
+        np.add.at(conteos, (np.arange(profundidad)[None, :], ventanas[:, :1], ventanas[:, 1:]), 1)
+        self.conteos = np.ascontiguousarray(conteos[:, :columnas, :columnas])
+        self.recientes = numeros[::-1][:profundidad].copy()  # recientes[l - 1]: número de hace l sorteos
+        self.total = len(numeros)
+
+    def ampliada(self, sorteos):
+        copia = TransicionesRetardo.__new__(TransicionesRetardo)
+        copia.conteos, copia.recientes, copia.total = self.conteos.copy(), self.recientes, self.total
+        for numero in sorteos["numero"].tolist(): copia.agregar(numero)
+        return copia
+
+    def agregar(self, numero):
+        if numero >= self.conteos.shape[1]:
+            crecer = numero + 1 - self.conteos.shape[1]
+            self.conteos = np.pad(self.conteos, ((0, 0), (0, crecer), (0, crecer)))
+        self.conteos[np.arange(len(self.recientes)), self.recientes, numero] += 1
+        self.recientes = np.concatenate([[numero], self.recientes[:len(self.conteos) - 1]])
+        self.total += 1
+
+    def puntuaciones(self, pesos):
+        # Σ_l pesos[l - 1] · conteos[l - 1, número de hace l sorteos]: una indexación para todos los retardos.
+        retardos = len(self.recientes)
+        return np.asarray(pesos[:retardos], np.float64) @ self.conteos[np.arange(retardos), self.recientes]
+
+# Registro de una secuencia de sorteos compartido por los ContextosNgrama construidos sobre ella: números en
+# orden y, por contexto, las posiciones de los sorteos que lo siguieron y sus números. Solo crece por el final.
+RegistroContextos = namedtuple("RegistroContextos", ["lock", "numeros", "contextos"])
+
+class ContextosNgrama:
+    # Qué salió después de cada contexto de 1..k sorteos seguidos. Es disperso: solo los contextos observados,
+    # con una clave entera que codifica la secuencia y su longitud. El modelo de los primeros n sorteos es una
+    # vista (n, últimos k números) sobre el registro de la secuencia, que solo lee las entradas con posición
+    # < n; ampliada() hace crecer el registro por el final (k entradas por sorteo) y no copia nada, de modo que
+    # los pasos del backtest comparten un único registro. Si los sorteos añadidos no siguen al registro, se
+    # crea uno nuevo.
+    __slots__ = ("orden", "base", "registro", "recientes", "total")
+
+    def __init__(self, sorteos, orden):
+        numeros = sorteos["numero"].astype(np.int64)
+        self.orden, self.base = orden, max(NUMERO_MAX, int(numeros.max(initial=0))) + 1
+        self.registro = self._registrar(numeros)
+        self.recientes = numeros[-orden:].tolist()
+        self.total = len(numeros)
+
+    def _registrar(self, numeros):
+        # Un argsort estable por orden agrupa las posiciones de cada contexto ya ordenadas.
+        contextos = {}
+        for j in range(1, self.orden + 1):
+            if len(numeros) <= j: break
+            ventanas = np.lib.stride_tricks.sliding_window_view(numeros, j + 1)
+            claves = self._claves(ventanas[:, :j])
+            orden = np.argsort(claves, kind="stable")
+            unicas, inicios = np.unique(claves[orden], return_index=True)
+            posiciones, siguientes = np.split(orden + j, inicios[1:]), np.split(ventanas[orden, j], inicios[1:])
+            for clave, pos, sig in zip(unicas.tolist(), posiciones, siguientes):
+                contextos[clave] = (array("i", pos.astype(np.int32).tobytes()), array("B", sig.astype(np.uint8).tobytes()))
+        return RegistroContextos(threading.Lock(), numeros.tolist(), contextos)
+
+    def _claves(self, contextos):
+        # Secuencia (del más antiguo al más reciente) en base K, más su longitud para separar órdenes.
+        return (contextos @ self.base ** np.arange(contextos.shape[1])) * (self.orden + 1) + contextos.shape[1]
+
+    def _clave(self, contexto):
+        return int(self._claves(np.array([contexto], np.int64))[0])
+
+    def ampliada(self, sorteos):
+        # Vista con `sorteos` añadidos al final; la original no cambia.
+        copia = ContextosNgrama.__new__(ContextosNgrama)
+        copia.orden, copia.base, copia.registro, copia.recientes, copia.total = self.orden, self.base, self.registro, self.recientes, self.total
+        copia._crecer(sorteos["numero"].tolist())
+        return copia
+
+    def agregar(self, numero):
+        self._crecer([numero])
+
+    def _crecer(self, nuevos):
+        if any(n >= self.base for n in nuevos): raise ValueError(f"numero fuera de rango (0..{self.base - 1})")
+        with self.registro.lock:
+            numeros = self.registro.numeros
+            comunes = min(len(nuevos), len(numeros) - self.total)
+            if numeros[self.total:self.total + comunes] != nuevos[:comunes]:
+                # Otra continuación de la secuencia: registro propio desde el prefijo de esta vista.
+                self.registro = self._registrar(np.array(numeros[:self.total], np.int64))
+                numeros, comunes = self.registro.numeros, 0
+            for numero in nuevos[comunes:]:
+                for j in range(1, min(self.orden, len(numeros)) + 1):
+                    posiciones, siguientes = self.registro.contextos.setdefault(self._clave(numeros[-j:]), (array("i"), array("B")))
+                    posiciones.append(len(numeros)); siguientes.append(numero)
+                numeros.append(numero)
+            self.total += len(nuevos)
+            self.recientes = numeros[max(self.total - self.orden, 0):self.total]
+
+    def siguientes(self, soporte_minimo):
+        # Conteos tras el contexto más largo con al menos `soporte_minimo` apariciones (back-off a
+        # contextos más cortos si no llega) y el orden usado; (None, 0) si ninguno alcanza.
+        for j in range(len(self.recientes), 0, -1):
+            entrada = self.registro.contextos.get(self._clave(self.recientes[-j:]))
+            if entrada is None: continue
+            apariciones = bisect.bisect_left(entrada[0], self.total)
+            if apariciones and apariciones >= soporte_minimo:
+                return np.bincount(np.frombuffer(entrada[1][:apariciones], np.uint8), minlength=self.base), j
+        return None, 0
+
+# Registro compartido por los HuecosApariciones de una misma secuencia de sorteos: por unidad y número, los
+# huecos en orden cronológico, el sorteo que cerró cada uno, sus sumas y sumas de cuadrados acumuladas y
+# todos los huecos ordenados. Solo crece por el final.
+RegistroHuecos = namedtuple("RegistroHuecos", ["lock", "numeros", "dias", "huecos", "cierres", "sumas", "cuadrados", "ordenados"])
+
+class HuecosApariciones:
+    # Huecos entre apariciones consecutivas de cada número, en sorteos y en días. En días solo cuentan los
+    # días distintos: varias salidas el mismo día no abren hueco en días, sí en sorteos. El modelo de los
+    # primeros n sorteos es una vista (n, últimas apariciones) sobre el registro de la secuencia: cuenta los
+    # huecos cerrados antes de n (una búsqueda binaria), toma media y varianza de las sumas acumuladas y los
+    # percentiles de la lista ordenada, descontando los pocos huecos que el registro tenga por delante de la
+    # vista. ampliada() añade al registro un hueco por unidad y sorteo, sin copiar nada; una vista muy
+    # atrasada (más de ATRASO_MAXIMO sorteos) o con otra continuación se amplía sobre un registro propio.
+    UNIDADES = ("sorteos", "dias")
+    ATRASO_MAXIMO = 64
+    __slots__ = ("total", "registro", "_ultimos")
+
+    def __init__(self, sorteos):
+        numeros, dias = sorteos["numero"].astype(np.int64), sorteos["dia"].astype(np.int64)
+        self._registrar(numeros, dias, max(NUMERO_MAX, int(numeros.max(initial=0))) + 1)
+
+    def _registrar(self, numeros, dias, columnas):
+        self.total = len(numeros)
+        self._ultimos = np.full((2, columnas), -1, np.int64)
+        listas = [[[[] for _ in range(columnas)] for _ in self.UNIDADES] for _ in range(5)]
+        orden = np.argsort(numeros, kind="stable")
+        limites = np.searchsorted(numeros[orden], np.arange(columnas + 1))
+        for numero in range(columnas):
+            posiciones = orden[limites[numero]:limites[numero + 1]]
+            distintos = np.flatnonzero(np.diff(dias[posiciones], prepend=-1) != 0)  # primera salida de cada día
+            for u, (valores, cierres) in enumerate(((posiciones, posiciones), (dias[posiciones[distintos]], posiciones[distintos]))):
+                huecos = np.diff(valores)
+                for lista, datos in zip(listas, (huecos, cierres[1:], np.cumsum(huecos), np.cumsum(huecos * huecos), np.sort(huecos))):
+                    lista[u][numero] = datos.tolist()
+                if len(valores): self._ultimos[u, numero] = valores[-1]
+        self.registro = RegistroHuecos(threading.Lock(), numeros.tolist(), dias.tolist(), *listas)
+
+    def ampliada(self, sorteos):
+        copia = HuecosApariciones.__new__(HuecosApariciones)
+        copia.total, copia.registro, copia._ultimos = self.total, self.registro, self._ultimos.copy()
+        copia._crecer(sorteos["numero"].tolist(), sorteos["dia"].tolist())
+        return copia
+
+    def agregar(self, numero, dia):
+        self._crecer([numero], [dia])
+
+    def _crecer(self, numeros, dias):
+        if any(n >= self._ultimos.shape[1] for n in numeros): raise ValueError(f"numero fuera de rango (0..{self._ultimos.shape[1] - 1})")
+        with self.registro.lock:
+            registro = self.registro
+            comunes = min(len(numeros), len(registro.numeros) - self.total)
+            if comunes and (len(registro.numeros) - self.total > self.ATRASO_MAXIMO or registro.numeros[self.total:self.total + comunes] != numeros[:comunes]
+                            or registro.dias[self.total:self.total + comunes] != dias[:comunes]):
+                self._registrar(np.array(registro.numeros[:self.total], np.int64), np.array(registro.dias[:self.total], np.int64), self._ultimos.shape[1])
+                registro = self.registro
+            for numero, dia in zip(numeros, dias):
+                if self.total == len(registro.numeros):
+                    for u, valor in enumerate((self.total, dia)):
+                        ultimo = int(self._ultimos[u, numero])
+                        if ultimo < 0 or valor == ultimo: continue
+                        hueco, sumas, cuadrados = valor - ultimo, registro.sumas[u][numero], registro.cuadrados[u][numero]
+                        registro.huecos[u][numero].append(hueco)
+                        registro.cierres[u][numero].append(self.total)
+                        sumas.append((sumas[-1] if sumas else 0) + hueco)
+                        cuadrados.append((cuadrados[-1] if cuadrados else 0) + hueco * hueco)
+                        bisect.insort(registro.ordenados[u][numero], hueco)
+                    registro.numeros.append(numero); registro.dias.append(dia)
+                self._ultimos[:, numero] = self.total, dia
+                self.total += 1
+
+    @staticmethod
+    def _kesimo(ordenados, excluidos, k):
+        # k-ésimo (desde 0) de `ordenados` sin los `excluidos` (ordenados, y contenidos en él).
+        for excluido in excluidos:
+            if excluido > ordenados[k]: break
+            k += 1
+        return ordenados[k]
+
+    @classmethod
+    def _percentil(cls, ordenados, excluidos, q):
+        # Interpolación lineal entre vecinos, como np.percentile.
+        posicion = q / 100 * (len(ordenados) - len(excluidos) - 1)
+        bajo = int(posicion)
+        alto = min(bajo + 1, len(ordenados) - len(excluidos) - 1)
+        valor_bajo = cls._kesimo(ordenados, excluidos, bajo)
+        return valor_bajo + (cls._kesimo(ordenados, excluidos, alto) - valor_bajo) * (posicion - bajo)
+
+    def estadisticas(self, unidad, dia_actual=None):
+        # Por número (posición = número): media, mediana, p90 y varianza de sus huecos, y el percentil del
+        # hueco abierto desde su última aparición (hasta el próximo sorteo, o hasta dia_actual en días).
+        # NaN donde no hay huecos.
+        u, registro = self.UNIDADES.index(unidad), self.registro
+        actual = self.total if u == 0 else dia_actual
+        columnas = self._ultimos.shape[1]
+        cantidad, sumas, cuadrados = np.zeros(columnas), np.zeros(columnas), np.zeros(columnas)
+        mediana, p90, percentil_actual = np.full(columnas, np.nan), np.full(columnas, np.nan), np.full(columnas, np.nan)
+        with registro.lock:
+            for numero in range(columnas):
+                k = bisect.bisect_left(registro.cierres[u][numero], self.total)
+                if not k: continue
+                ordenados, excluidos = registro.ordenados[u][numero], sorted(registro.huecos[u][numero][k:])
+                cantidad[numero], sumas[numero], cuadrados[numero] = k, registro.sumas[u][numero][k - 1], registro.cuadrados[u][numero][k - 1]
+                mediana[numero], p90[numero] = self._percentil(ordenados, excluidos, 50), self._percentil(ordenados, excluidos, 90)
+                ultimo = int(self._ultimos[u, numero])
+                if actual is not None and ultimo >= 0:
+                    abierto = actual - ultimo
+                    percentil_actual[numero] = 100 * (bisect.bisect_right(ordenados, abierto) - bisect.bisect_right(excluidos, abierto)) / k
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media = sumas / cantidad
+            varianza = cuadrados / cantidad - media ** 2
+        return {"media": media, "varianza": np.maximum(varianza, 0), "mediana": mediana, "p90": p90, "percentil_actual": percentil_actual}
+
+@st.cache_resource
+def _cache_transiciones():
+    return threading.Lock(), OrderedDict()
+
+def _transiciones_hasta_corte(clase, sorteos, version, *args):
+    # Con `version`, sorteos son los primeros sorteos (en orden cronológico) de esa versión del histórico y
+    # el resultado se guarda por (versión, nº de sorteos) en una LRU. Si ya está un corte anterior de la
+    # misma versión (el paso previo del backtest) se amplía con los sorteos que faltan.
+    if version is None: return clase(sorteos[_orden_cronologico(sorteos)], *args)
+    modelo = (clase.__name__, args, version)
+    # La clave es la longitud del prefijo y no su último slot: con sorteos repetidos en (fecha, franja)
+    # dos prefijos distintos terminan en el mismo slot.
+    clave = modelo + (len(sorteos),)
+    lock, cache = _cache_transiciones()
+    with lock:
+        transiciones = cache.get(clave)
+        if transiciones is not None:
+            cache.move_to_end(clave)
+            return transiciones
+        previa = max((t for c, t in cache.items() if c[:3] == modelo and t.total <= len(sorteos)), key=lambda t: t.total, default=None)
+    transiciones = clase(sorteos, *args) if previa is None else previa.ampliada(sorteos[previa.total:])
+    with lock:
+        cache[clave] = transiciones
+        while len(cache) > 64: cache.popitem(last=False)
+    return transiciones
+
+def build_affinity_map(sorteos, version=None):
+    return _transiciones_hasta_corte(TransicionesAfinidad, sorteos, version)
+
+def build_lag_affinity_map(sorteos, profundidad, version=None):
+    return _transiciones_hasta_corte(TransicionesRetardo, sorteos, version, profundidad)
+
+def build_context_map(sorteos, orden, version=None):
+    return _transiciones_hasta_corte(ContextosNgrama, sorteos, version, orden)
+
+def build_gap_index(sorteos, version=None):
+    return _transiciones_hasta_corte(HuecosApariciones, sorteos, version)
+
+def generar_prediccion_afinidad(df_historico, params, version=None):
     if len(df_historico) < 2: return []
-    affinity_map = build_affinity_map(df_historico.copy())
-    last_num = df_historico.sort_values(by=['fecha', 'franja_order']).iloc[-1]['numero']
-    if last_num not in affinity_map: return []
-    followers = affinity_map[last_num]
-    confiables = {num: count for num, count in followers.items() if count >= params.get('umbral_confianza', 2)}
-    if not confiables: return []
-    return sorted(confiables, key=confiables.get, reverse=True)[:params.get('numero_candidatos', 5)]
+    sorteos = _a_sorteos(df_historico)
+    affinity_map = build_affinity_map(sorteos, version)
+    slots = _slots(sorteos)
+    ultimo = len(slots) - 1 - np.argmax(slots[::-1])  # último sorteo, sin ordenar
+    last_num = int(sorteos["numero"][ultimo])
+    # Por franja: solo cuentan las transiciones hacia la franja del sorteo siguiente (la de get_next_sorteo).
+    franja = (int(slots[ultimo]) + 1) % len(franjas) if params.get('modo_afinidad') == "Por franja" else None
+    return affinity_map.seguidores(last_num, params.get('umbral_confianza', 2), params.get('numero_candidatos', 5), franja)
+
+def generar_prediccion_retardos(df_historico, params, version=None):
+    # Afinidad con los L sorteos anteriores: cada retardo l aporta lo que siguió, l sorteos después, al
+    # número de hace l sorteos, con peso decaimiento^(l - 1).
+    if len(df_historico) < 2: return []
+    profundidad = params.get('profundidad_retardos', 3)
+    retardos = build_lag_affinity_map(_a_sorteos(df_historico), profundidad, version)
+    puntuaciones = retardos.puntuaciones(params.get('decaimiento_retardos', 0.5) ** np.arange(profundidad))
+    candidatos = np.flatnonzero(puntuaciones > 0)
+    orden = np.lexsort((candidatos, -puntuaciones[candidatos]))
+    return candidatos[orden][:params.get('numero_candidatos', 5)].tolist()
+
+def generar_prediccion_contexto(df_historico, params, version=None):
+    # "Tras la secuencia 9, 3, 12, ¿qué salió?": cadena de Markov de orden k con back-off.
+    if len(df_historico) < 2: return []
+    contextos = build_context_map(_a_sorteos(df_historico), params.get('orden_contexto', 3), version)
+    conteos, _ = contextos.siguientes(params.get('soporte_contexto', 3))
+    if conteos is None: return []
+    candidatos = np.flatnonzero(conteos)
+    orden = np.lexsort((candidatos, -conteos[candidatos]))
+    return candidatos[orden][:params.get('numero_candidatos', 5)].tolist()
 
 def generar_prediccion_persistencia(df_historico, params):
     retraso = params.get('retraso_sorteos', 5)
     if len(df_historico) < retraso: return []
-    numeros_base = df_historico.tail(retraso)['numero'].unique().tolist()
+    numeros_base = pd.unique(np.asarray(df_historico['numero'])[len(df_historico) - retraso:]).tolist()
     return numeros_base
 
 # --- NUEVA Estrategia: Semáforo Predictivo 🚦 ---
-def generar_prediccion_semaforo(df_historico, fecha_str, params):
+def generar_prediccion_semaforo(df_historico, fecha_str, params, indice=None, version=None):
     # Parámetros de usuario
     umbral_rotacion_verde = params.get('rotacion_verde', 4)
     umbral_momentum_verde = params.get('momentum_verde', 2)
@@ -132,45 +1528,40 @@ def generar_prediccion_semaforo(df_historico, fecha_str, params):
     num_amarillos = params.get('num_amarillos', 3)
     num_rojos = params.get('num_rojos', 3)
 
-    fecha_actual = pd.to_datetime(fecha_str)
-    todos_numeros = df_historico['numero'].unique()
-    if df_historico.empty: return []
+    fecha_actual = pd.Timestamp(fecha_str)
+    if len(df_historico) == 0: return []
+    corte = len(df_historico)
+    if indice is None:
+        sorteos = _a_sorteos(df_historico)
+        indice = IndiceOcurrencias(sorteos)
+        todos_numeros = pd.unique(sorteos['numero']).astype(np.int64)
+    else: todos_numeros = indice.orden_aparicion(corte)  # mismo orden que pd.unique, sin recorrer df
 
-    # Rotación: promedio de días entre apariciones
-    rotaciones = {n: calcular_rotacion(df_historico, n) for n in todos_numeros}
+    # Rasgos alineados con todos_numeros. Rotación: promedio (o mediana, p90) de días entre apariciones (NaN si no hay)
+    medida = params.get('medida_rotacion', "Media")
+    if medida == "Media": rot = indice.rotaciones(corte)[todos_numeros]
+    else:
+        rotaciones = calcular_rotaciones(df_historico, todos_numeros.tolist(), medida, indice, version)
+        rot = np.array([np.nan if rotaciones[n] is None else rotaciones[n] for n in todos_numeros.tolist()], np.float64)
     # Momentum: apariciones en la ventana reciente
-    df_historico_copy = df_historico.copy()
-    df_historico_copy["fecha_dt"] = pd.to_datetime(df_historico_copy["fecha"]).dt.date
-    ventana_inicio = (fecha_actual.date() - timedelta(days=ventana_maduracion))
-    momentum = df_historico_copy[df_historico_copy["fecha_dt"] >= ventana_inicio]['numero'].value_counts().to_dict()
+    desde = indice.posicion(_slot(fecha_actual.toordinal() - ventana_maduracion, 0), corte)
+    mom = indice.conteos(desde, corte)[todos_numeros].astype(np.int64)
     # Maduración: días desde última aparición
-    maduracion = {n: calcular_puntuacion_sorpresa(n, df_historico, fecha_actual) for n in todos_numeros}
-
-    # Cálculos compuestos para semáforo
-    verdes = []
-    amarillos = []
-    rojos = []
-    for n in todos_numeros:
-        rot = rotaciones.get(n, 100)
-        mom = momentum.get(n, 0)
-        mad = maduracion.get(n, 100)
-        # Verde: rotación baja, momentum alto, maduración baja
-        if rot is not None and rot <= umbral_rotacion_verde and mom >= umbral_momentum_verde and mad <= ventana_maduracion:
-            verdes.append((n, rot, mom, mad))
-        # Amarillo: valores intermedios
-        elif rot is not None and mom > 0 and mad <= ventana_maduracion*2:
-            amarillos.append((n, rot, mom, mad))
-        else:
-            rojos.append((n, rot, mom, mad))
-    # Ordenar por momentum y maduración
-    verdes = sorted(verdes, key=lambda x: (-x[2], x[3]))[:num_verdes]
-    amarillos = sorted(amarillos, key=lambda x: (-x[2], x[3]))[:num_amarillos]
-    rojos = sorted(rojos, key=lambda x: (x[3], -x[2]))[:num_rojos]
-    # Extraer sólo número
+    mad = indice.sorpresas(fecha_actual.toordinal(), corte)[todos_numeros]
+
+    # Verde: rotación baja, momentum alto, maduración baja; amarillo: valores intermedios; rojo: el resto
+    con_rotacion = ~np.isnan(rot)
+    verde = con_rotacion & (np.where(con_rotacion, rot, np.inf) <= umbral_rotacion_verde) & (mom >= umbral_momentum_verde) & (mad <= ventana_maduracion)
+    amarillo = ~verde & con_rotacion & (mom > 0) & (mad <= ventana_maduracion*2)
+    rojo = ~(verde | amarillo)
+    # Ordenar por momentum y maduración (lexsort es estable: empates en orden de aparición)
+    def ordenados(mascara, *claves):
+        elegidos = np.flatnonzero(mascara)
+        return todos_numeros[elegidos[np.lexsort([c[elegidos] for c in claves])]]
     return {
-        'verdes': [v[0] for v in verdes],
-        'amarillos': [a[0] for a in amarillos],
-        'rojos': [r[0] for r in rojos]
+        'verdes': ordenados(verde, mad, -mom)[:num_verdes].tolist(),
+        'amarillos': ordenados(amarillo, mad, -mom)[:num_amarillos].tolist(),
+        'rojos': ordenados(rojo, -mom, mad)[:num_rojos].tolist()
     }
 
 # --- Funciones Auxiliares de la Interfaz ---
@@ -182,6 +1573,15 @@ def render_strategy_parameters(strategy_name, key_prefix):
     elif "Afinidad" in strategy_name:
         params['numero_candidatos'] = st.sidebar.number_input("Candidatos a Mostrar", 3, 20, 5, 1, key=f"{key_prefix}_nc_afinidad")
         params['umbral_confianza'] = st.sidebar.number_input("Umbral de Confianza", 1, 10, 2, 1, key=f"{key_prefix}_uc_afinidad")
+        params['modo_afinidad'] = st.sidebar.selectbox("Modo", ["General", "Por franja"], 0, key=f"{key_prefix}_modo_afinidad")
+    elif "Contexto" in strategy_name:
+        params['numero_candidatos'] = st.sidebar.number_input("Candidatos", 3, 20, 5, 1, key=f"{key_prefix}_nc_contexto")
+        params['orden_contexto'] = st.sidebar.slider("Longitud del contexto (sorteos)", 1, 6, 3, key=f"{key_prefix}_orden_contexto")
+        params['soporte_contexto'] = st.sidebar.number_input("Apariciones mínimas del contexto", 1, 20, 3, 1, key=f"{key_prefix}_sop_contexto")
+    elif "Retardos" in strategy_name:
+        params['numero_candidatos'] = st.sidebar.number_input("Candidatos", 3, 20, 5, 1, key=f"{key_prefix}_nc_retardos")
+        params['profundidad_retardos'] = st.sidebar.slider("Retardos (sorteos hacia atrás)", 1, 10, 3, key=f"{key_prefix}_prof_retardos")
+        params['decaimiento_retardos'] = st.sidebar.slider("Peso de cada retardo respecto al anterior", 0.1, 1.0, 0.5, 0.1, key=f"{key_prefix}_dec_retardos")
     elif "Detective" in strategy_name:
         params['numero_candidatos'] = st.sidebar.number_input("Candidatos", 3, 20, 5, 1, key=f"{key_prefix}_nc_detective")
         params['peso_racha'] = st.sidebar.number_input("🔥 Peso Racha", 0.0, 5.0, 1.5, 0.1, "%.1f", key=f"{key_prefix}_pr")
@@ -189,13 +1589,17 @@ def render_strategy_parameters(strategy_name, key_prefix):
         params['peso_consistencia'] = st.sidebar.number_input("🛡️ Peso Consistencia", 0.0, 5.0, 0.3, 0.1, "%.1f", key=f"{key_prefix}_pc")
     elif "Doble Estrategia" in strategy_name:
         params['umbral_rotacion'] = st.sidebar.slider("Umbral Rotación (días)", 1, 15, 4, key=f"{key_prefix}_ur")
+        params['medida_rotacion'] = st.sidebar.selectbox("Medida de rotación", list(MEDIDAS_ROTACION), 0, key=f"{key_prefix}_mr_doble")
         params['numero_candidatos'] = st.sidebar.number_input("Candidatos", 3, 20, 7, 1, key=f"{key_prefix}_nc_doble")
     elif "Patrones de Corto Plazo" in strategy_name:
-        params['ventana_dias'] = st.sidebar.number_input("Ventana (días)", 3, 30, 10, 1, key=f"{key_prefix}_vd")
+        params['ventana_dias'] = st.sidebar.number_input("Ventana (días)", 3, 365, 10, 1, key=f"{key_prefix}_vd")
         params['numero_candidatos'] = st.sidebar.number_input("Candidatos", 3, 20, 5, 1, key=f"{key_prefix}_nc_corto")
-        params['tipo_ponderacion'] = st.sidebar.selectbox("Ponderación", ["Exponencial", "Lineal"], 0, key=f"{key_prefix}_tp")
+        params['tipo_ponderacion'] = st.sidebar.selectbox("Ponderación", ["Exponencial", "Lineal", "Vida media"], 0, key=f"{key_prefix}_tp")
+        if params['tipo_ponderacion'] == "Vida media":
+            params['vida_media'] = st.sidebar.selectbox("Vida media (sorteos)", VIDAS_MEDIAS, 1, key=f"{key_prefix}_vm")
     elif "Semáforo Predictivo" in strategy_name:
         params['rotacion_verde'] = st.sidebar.slider("Rot. Verde (días)", 1, 15, 4, key=f"{key_prefix}_rot_verde")
+        params['medida_rotacion'] = st.sidebar.selectbox("Medida de rotación", list(MEDIDAS_ROTACION), 0, key=f"{key_prefix}_mr_semaforo")
         params['momentum_verde'] = st.sidebar.slider("Momentum Verde (mín. apariciones)", 1, 10, 2, key=f"{key_prefix}_mom_verde")
         params['ventana_maduracion'] = st.sidebar.slider("Maduración (días)", 3, 30, 10, key=f"{key_prefix}_vent_mad")
         params['num_verdes'] = st.sidebar.number_input("Números 🟢", 1, 10, 3, 1, key=f"{key_prefix}_n_verde")
@@ -204,24 +1608,18 @@ def render_strategy_parameters(strategy_name, key_prefix):
     return params
 
 def get_next_sorteo(df):
-    if df.empty: return "mañana", datetime.today().strftime("%Y-%m-%d")
-    df_sorted = df.sort_values(by=['fecha', 'franja_order'])
-    last_sorteo = df_sorted.iloc[-1]
-    last_franja_index = franjas.index(last_sorteo['franja'])
-    
-    if last_franja_index == len(franjas) - 1:
-        next_franja = franjas[0]
-        next_date = (pd.to_datetime(last_sorteo['fecha']) + timedelta(days=1)).strftime("%Y-%m-%d")
-    else:
-        next_franja = franjas[last_franja_index + 1]
-        next_date = last_sorteo['fecha']
-    return next_franja, next_date
+    if len(df) == 0: return "mañana", datetime.today().strftime("%Y-%m-%d")
+    # El siguiente sorteo es el índice global siguiente al último: tras la madrugada, mañana del día siguiente.
+    next_dia, next_franja_index = divmod(int(_slots(_a_sorteos(df)).max()) + 1, len(franjas))
+    return franjas[next_franja_index], datetime.fromordinal(next_dia).strftime("%Y-%m-%d")
 
 # --- Módulos de la Aplicación ---
 def modulo_prediccion():
     st.header("🔮 Generador de Predicciones")
     strategy_options = [
         "Estrategia de Afinidad 🤝", 
+        "Estrategia de Retardos 🔗", 
+        "Estrategia de Contexto 🧩", 
         "Estrategia de Persistencia (Eco) 📢", 
         "Estrategia del Detective 🕵️", 
         "Patrones de Corto Plazo 📈", 
@@ -231,29 +1629,36 @@ def modulo_prediccion():
     strategy_name = st.selectbox("¿Qué tipo de análisis deseas usar?", strategy_options)
     params = render_strategy_parameters(strategy_name, key_prefix='pred')
     
-    if not st.session_state.resultados:
+    instantanea = HISTORIAL.actual
+    if not instantanea.registros:
         st.warning("⚠️ No hay datos suficientes."); return
     
-    df = pd.DataFrame(st.session_state.resultados)
-    franja_map = {franja: i for i, franja in enumerate(franjas)}
-    df['franja_order'] = df['franja'].map(franja_map)
+    if MOTOR_DATOS == "binario":
+        version_datos, df, indice = historial_binario()  # arrays compartidos, sin DataFrame
+    else:
+        tipado = historial_tipado(instantanea)
+        version_datos, df, indice = instantanea.version, tipado.sorteos, tipado.ocurrencias
 
     next_franja, next_date = get_next_sorteo(df)
     st.subheader(f"🎯 Predicción para el próximo sorteo: {next_franja.capitalize()} ({next_date})")
 
     candidatos = []
-    if "Afinidad" in strategy_name: candidatos = generar_prediccion_afinidad(df.copy(), params)
-    elif "Persistencia" in strategy_name: candidatos = generar_prediccion_persistencia(df.copy(), params)
-    elif "Detective" in strategy_name: candidatos = generar_prediccion_detective(df.copy(), next_date, params)
+    if "Afinidad" in strategy_name: candidatos = generar_prediccion_afinidad(df, params, version_datos)
+    elif "Retardos" in strategy_name: candidatos = generar_prediccion_retardos(df, params, version_datos)
+    elif "Contexto" in strategy_name: candidatos = generar_prediccion_contexto(df, params, version_datos)
+    elif "Persistencia" in strategy_name: candidatos = generar_prediccion_persistencia(df, params)
+    elif "Detective" in strategy_name: candidatos = generar_prediccion_detective(df, next_date, params, indice)
     elif "Doble Estrategia" in strategy_name:
-        numeros_en_datos = df['numero'].unique()
-        rotaciones = {n: calcular_rotacion(df, n) for n in numeros_en_datos}
+        # Orden de primera aparición en el histórico cronológico (no en el del fichero): decide los empates
+        # en pesos, p. ej. cuando todos siguen a 0.
+        numeros_en_datos = pd.unique(np.asarray(df['numero'])).tolist()
+        rotaciones = calcular_rotaciones(df, numeros_en_datos, params['medida_rotacion'], indice, version_datos)
         activos = [n for n, r in rotaciones.items() if r is not None and r <= params['umbral_rotacion']]
         if not activos: activos = list(numeros_en_datos)
         candidatos_ordenados = sorted(activos, key=lambda n: st.session_state.pesos.get(n, 0), reverse=True)
         candidatos = candidatos_ordenados[:params['numero_candidatos']]
     elif "Semáforo Predictivo" in strategy_name:
-        resultado_semaforo = generar_prediccion_semaforo(df.copy(), next_date, params)
+        resultado_semaforo = generar_prediccion_semaforo(df, next_date, params, indice, version_datos)
         # Mostrar semáforo en métricas
         st.markdown("#### 🟢 Alta probabilidad")
         st.info(", ".join(str(x) for x in resultado_semaforo['verdes']) if resultado_semaforo['verdes'] else "Sin candidatos")
@@ -264,7 +1669,13 @@ def modulo_prediccion():
         # Para coherencia con el resto, 'candidatos' será la suma de todos
         candidatos = resultado_semaforo['verdes'] + resultado_semaforo['amarillos'] + resultado_semaforo['rojos']
     else: # Corto Plazo
-        candidatos = generar_prediccion_corto_plazo(df.copy(), next_date, params['ventana_dias'], params['numero_candidatos'], params['tipo_ponderacion'])
+        # Las ventanas precalculadas salen de la caché por versión (con el índice de apariciones la primera vez)
+        # y la recencia por vida media necesita ese índice; las ventanas más largas, del árbol de frecuencias
+        # del histórico compartido, ya al día. La instantánea ya está en memoria: no se relee el almacén.
+        precalculada = params['ventana_dias'] in VENTANAS_CORTO_PLAZO and params['tipo_ponderacion'] in PuntuacionesCortoPlazo.PONDERACIONES
+        indice_corto = HISTORIAL.frecuencias(instantanea) if not precalculada and params['tipo_ponderacion'] != "Vida media" else None
+        if indice_corto is None or indice_corto.total != len(df): indice_corto = indice
+        candidatos = generar_prediccion_corto_plazo(df, next_date, params['ventana_dias'], params['numero_candidatos'], params['tipo_ponderacion'], indice_corto, params.get('vida_media', VIDAS_MEDIAS[1]), version_datos)
         
     if not candidatos or len(candidatos) < 3:
         st.error("La estrategia no pudo generar suficientes candidatos. Prueba a ajustar los parámetros.")
@@ -278,6 +1689,8 @@ def modulo_backtesting():
     st.header("🧪 Backtesting Interactivo (Análisis por Sorteo)")
     strategy_options_bt = [
         "Estrategia de Afinidad 🤝", 
+        "Estrategia de Retardos 🔗", 
+        "Estrategia de Contexto 🧩", 
         "Estrategia de Persistencia (Eco) 📢", 
         "Estrategia del Detective 🕵️", 
         "Patrones de Corto Plazo 📈", 
@@ -287,16 +1700,19 @@ def modulo_backtesting():
     strategy_name_bt = st.selectbox("¿Qué estrategia quieres simular?", strategy_options_bt, key="bt_strategy_selector")
     params_bt = render_strategy_parameters(strategy_name_bt, key_prefix='bt')
     
-    if len(st.session_state.resultados) < 20:
+    instantanea = HISTORIAL.actual
+    if len(instantanea.registros) < 20:
         st.warning("⚠️ Necesitas al menos 20 resultados."); return
         
-    df = pd.DataFrame(st.session_state.resultados)
-    df["fecha"] = pd.to_datetime(df["fecha"]).dt.strftime('%Y-%m-%d')
-    franja_map = {franja: i for i, franja in enumerate(franjas)}
-    df['franja_order'] = df['franja'].map(franja_map)
-    df_sorted = df.sort_values(by=['fecha', 'franja_order']).reset_index(drop=True)
+    # La simulación corre sobre arrays ordenados por sorteo; cada paso usa una vista del prefijo, sin copias,
+    # y consulta el índice de apariciones con ese corte.
+    if MOTOR_DATOS == "binario":
+        version_datos, sorteos, indice = historial_binario()
+    else:
+        tipado = historial_tipado(instantanea); version_datos, sorteos, indice = instantanea.version, tipado.sorteos, tipado.ocurrencias
     
-    fechas_disponibles = sorted(df_sorted["fecha"].unique())
+    dias_disponibles = np.unique(sorteos["dia"]).tolist()
+    fechas_disponibles = [datetime.fromordinal(d).strftime("%Y-%m-%d") for d in dias_disponibles]
     col1, col2 = st.columns(2)
     default_idx = len(fechas_disponibles) - 11 if len(fechas_disponibles) > 10 else 0
     fecha_inicio = col1.selectbox("Fecha inicio", fechas_disponibles, index=default_idx)
@@ -306,44 +1722,62 @@ def modulo_backtesting():
     if st.button("▶️ Ejecutar Backtesting Reactivo"):
         with st.spinner(f"🧠 Simulado la '{strategy_name_bt}' sorteo a sorteo..."):
             
-            try:
-                start_index = df_sorted[df_sorted['fecha'] == fecha_inicio].index.min()
-                end_index = df_sorted[df_sorted['fecha'] == fecha_fin].index.max()
-            except ValueError:
+            # Cortes por índice global de sorteo: del primer sorteo de fecha_inicio al último de fecha_fin.
+            slots = _slots(sorteos)
+            start_index = int(np.searchsorted(slots, _slot(datetime.strptime(fecha_inicio, "%Y-%m-%d").toordinal(), 0), side="left"))
+            end_index = int(np.searchsorted(slots, _slot(datetime.strptime(fecha_fin, "%Y-%m-%d").toordinal() + 1, 0), side="left")) - 1
+            if start_index > end_index:
                 st.error("El rango de fechas seleccionado no contiene datos. Por favor, elige otras fechas.")
                 return
 
             resultados_bt = []
             
-            todos_numeros = df_sorted['numero'].unique()
+            todos_numeros = pd.unique(sorteos['numero']).tolist()
             pesos_bt = {n: 0 for n in todos_numeros}
             sorteos_sin_acertar = {n: 0 for n in todos_numeros}
             sorteos_desde_ultimo_acierto_general = 0
+            # Corto Plazo: aciertos de todas las ventanas y ponderaciones, de la misma matriz que la elegida.
+            todas_las_ventanas = "Patrones de Corto Plazo" in strategy_name_bt and params_bt['tipo_ponderacion'] in PuntuacionesCortoPlazo.PONDERACIONES
+            forma_ventanas = (len(PuntuacionesCortoPlazo.PONDERACIONES), len(VENTANAS_CORTO_PLAZO))
+            evaluados_ventanas, aciertos_ventanas = np.zeros(forma_ventanas, np.int64), np.zeros(forma_ventanas, np.int64)
             
             for i in range(start_index, end_index + 1):
-                sorteo_actual = df_sorted.loc[i]
-                df_historico = df_sorted.iloc[:i]
+                fecha_sorteo = datetime.fromordinal(int(sorteos["dia"][i])).strftime("%Y-%m-%d")
+                franja_sorteo = franjas[int(sorteos["franja"][i])]
+                df_historico = sorteos[:i]
                 
                 candidatos = []
-                if "Afinidad" in strategy_name_bt: candidatos = generar_prediccion_afinidad(df_historico.copy(), params_bt)
-                elif "Persistencia" in strategy_name_bt: candidatos = generar_prediccion_persistencia(df_historico.copy(), params_bt)
-                elif "Detective" in strategy_name_bt: candidatos = generar_prediccion_detective(df_historico.copy(), sorteo_actual['fecha'], params_bt)
+                if "Afinidad" in strategy_name_bt: candidatos = generar_prediccion_afinidad(df_historico, params_bt, version_datos)
+                elif "Retardos" in strategy_name_bt: candidatos = generar_prediccion_retardos(df_historico, params_bt, version_datos)
+                elif "Contexto" in strategy_name_bt: candidatos = generar_prediccion_contexto(df_historico, params_bt, version_datos)
+                elif "Persistencia" in strategy_name_bt: candidatos = generar_prediccion_persistencia(df_historico, params_bt)
+                elif "Detective" in strategy_name_bt: candidatos = generar_prediccion_detective(df_historico, fecha_sorteo, params_bt, indice)
                 elif "Doble Estrategia" in strategy_name_bt:
-                    numeros_en_historico = df_historico['numero'].unique()
-                    rotaciones_dia = [n for n in numeros_en_historico if (rot := calcular_rotacion(df_historico, n)) is not None and rot <= params_bt['umbral_rotacion']]
+                    numeros_en_historico = pd.unique(df_historico['numero']).tolist()
+                    rotaciones = calcular_rotaciones(df_historico, numeros_en_historico, params_bt['medida_rotacion'], indice, version_datos)
+                    rotaciones_dia = [n for n, rot in rotaciones.items() if rot is not None and rot <= params_bt['umbral_rotacion']]
                     if not rotaciones_dia: activos = sorted(pesos_bt, key=lambda k: pesos_bt.get(k, 0), reverse=True)
                     else: activos = sorted(rotaciones_dia, key=lambda n: pesos_bt.get(n, 0), reverse=True)
                     candidatos = activos[:params_bt['numero_candidatos']]
                 elif "Semáforo Predictivo" in strategy_name_bt:
-                    resultado_semaforo = generar_prediccion_semaforo(df_historico.copy(), sorteo_actual['fecha'], params_bt)
+                    resultado_semaforo = generar_prediccion_semaforo(df_historico, fecha_sorteo, params_bt, indice, version_datos)
                     candidatos = resultado_semaforo['verdes'] + resultado_semaforo['amarillos'] + resultado_semaforo['rojos']
+                elif todas_las_ventanas:
+                    puntuaciones_cp = PuntuacionesCortoPlazo(indice, int(sorteos["dia"][i]), i)
+                    for t, tipo in enumerate(PuntuacionesCortoPlazo.PONDERACIONES):
+                        for v, ventana in enumerate(VENTANAS_CORTO_PLAZO):
+                            tres = puntuaciones_cp.candidatos(ventana, tipo, 3)
+                            if tres: evaluados_ventanas[t, v] += 1; aciertos_ventanas[t, v] += int(sorteos["numero"][i]) in tres
+                    if params_bt['ventana_dias'] in VENTANAS_CORTO_PLAZO:
+                        candidatos = puntuaciones_cp.candidatos(params_bt['ventana_dias'], params_bt['tipo_ponderacion'], params_bt['numero_candidatos'])
+                    else: candidatos = generar_prediccion_corto_plazo(df_historico, fecha_sorteo, params_bt['ventana_dias'], params_bt['numero_candidatos'], params_bt['tipo_ponderacion'], indice)
                 else: # Corto Plazo
-                    candidatos = generar_prediccion_corto_plazo(df_historico.copy(), sorteo_actual['fecha'], params_bt['ventana_dias'], params_bt['numero_candidatos'], params_bt['tipo_ponderacion'])
+                    candidatos = generar_prediccion_corto_plazo(df_historico, fecha_sorteo, params_bt['ventana_dias'], params_bt['numero_candidatos'], params_bt['tipo_ponderacion'], indice, params_bt.get('vida_media', VIDAS_MEDIAS[1]))
                 
                 if not candidatos: continue
 
                 prediccion_triple = sorted(candidatos[:3])
-                real = int(sorteo_actual["numero"])
+                real = int(sorteos["numero"][i])
                 acierto = real in prediccion_triple
                 
                 sorteos_espera = sorteos_sin_acertar.get(real, 0)
@@ -358,7 +1792,7 @@ def modulo_backtesting():
                 for n in sorteos_sin_acertar: sorteos_sin_acertar[n] += 1
 
                 resultados_bt.append({
-                    "fecha": sorteo_actual['fecha'], "franja": sorteo_actual['franja'], "predicho": ", ".join(map(str, prediccion_triple)), 
+                    "fecha": fecha_sorteo, "franja": franja_sorteo, "predicho": ", ".join(map(str, prediccion_triple)), 
                     "real": real, "acierto": acierto, "sorteos_espera": sorteos_espera, "racha_general": racha_general
                 })
                 
@@ -367,6 +1801,11 @@ def modulo_backtesting():
                     else: pesos_bt[prediccion_triple[0]] = pesos_bt.get(prediccion_triple[0], 0) + 1
                                     
             st.session_state.bt_df = pd.DataFrame(resultados_bt) if resultados_bt else None
+            st.session_state.bt_ventanas = None
+            if todas_las_ventanas and evaluados_ventanas.any():
+                precision = np.round(100 * aciertos_ventanas / np.maximum(evaluados_ventanas, 1), 2)
+                st.session_state.bt_ventanas = pd.DataFrame(precision.T, columns=list(PuntuacionesCortoPlazo.PONDERACIONES),
+                                                            index=pd.Index(list(VENTANAS_CORTO_PLAZO), name="Ventana (días)"))
 
     if "bt_df" in st.session_state and st.session_state.bt_df is not None:
         bt_df = st.session_state.bt_df
@@ -374,6 +1813,9 @@ def modulo_backtesting():
         st.subheader(f"Resultados para: {st.session_state.get('bt_strategy_selector')}")
         m_col1,m_col2,m_col3=st.columns(3)
         m_col1.metric("Predicciones",total); m_col2.metric("Aciertos",aciertos); m_col3.metric("Precisión",f"{porcentaje}%")
+        if st.session_state.get("bt_ventanas") is not None:
+            st.subheader("🪟 Precisión (%) de Corto Plazo con cada ventana")
+            st.dataframe(st.session_state.bt_ventanas.style.highlight_max(axis=None), use_container_width=True)
         st.markdown("---"); st.subheader("📋 Vista Diaria de Resultados (Pivotada por día)")
         # --- NUEVA VISUALIZACIÓN DIARIA ---
         # Transformación del bt_df para tabla pivotada
@@ -425,42 +1867,46 @@ def modulo_ingreso():
     st.header("🔢 Ingreso y Gestión de Resultados")
     st.subheader("🚀 Carga Masiva desde Archivo CSV")
     uploaded_file=st.file_uploader("Sube tu archivo con el historial (formato: fecha,franja,numero)", type="csv")
-    if uploaded_file is not None:
+    # El archivo se fusiona con el histórico (un número por sorteo) en lugar de reemplazarlo.
+    if uploaded_file is not None and st.session_state.get("csv_importado") != uploaded_file.file_id:
         try:
-            df_cargado=pd.read_csv(uploaded_file)
-            nuevos_resultados=df_cargado.to_dict('records')
-            st.session_state.resultados=nuevos_resultados
-            guardar_datos(st.session_state.resultados)
-            st.success(f"✅ ¡Se cargaron {len(nuevos_resultados)} resultados del archivo!")
+            sorteos, rechazados = leer_csv_por_bloques(uploaded_file)
+            insertados, actualizados = HISTORIAL.fusionar(sorteos)
+            st.session_state.csv_importado = uploaded_file.file_id
+            st.session_state.informe_csv = (insertados, actualizados, len(sorteos) - insertados - actualizados, rechazados)
             st.rerun()
         except Exception as e: st.error(f"❌ Error al procesar el archivo: {e}")
+    if uploaded_file is not None and "informe_csv" in st.session_state:
+        insertados, actualizados, sin_cambios, rechazados = st.session_state.informe_csv
+        st.success(f"✅ Importación completada: {insertados} nuevos, {actualizados} actualizados, {sin_cambios} sin cambios.")
+        if rechazados: st.warning(f"⚠️ Se rechazaron {rechazados} filas con fecha, franja o número no válidos.")
     st.markdown("---")
     st.subheader("✍️ Ingreso Manual de Resultados")
     col1,col2,col3=st.columns(3)
     with col1: fecha=st.date_input("Fecha del sorteo", value=datetime.today())
     with col2: franja=st.selectbox("Franja horaria", franjas)
-    with col3: numero_ganador=st.number_input("Número ganador", min_value=0, step=1)
+    with col3: numero_ganador=st.number_input("Número ganador", min_value=0, max_value=NUMERO_MAX, step=1)
     if st.button("➕ Agregar resultado"):
         nuevo_resultado={"fecha": fecha.strftime("%Y-%m-%d"), "franja": franja, "numero": numero_ganador}
-        if nuevo_resultado not in st.session_state.resultados:
-            st.session_state.resultados.append(nuevo_resultado)
-            guardar_datos(st.session_state.resultados)
+        # Si el sorteo (fecha, franja) ya existe con otro número se corrige.
+        if HISTORIAL.agregar(nuevo_resultado) == "existente":
+            st.warning("⚠️ Este resultado ya existe.")
+        else:
             st.success("✅ Resultado agregado correctamente")
             st.rerun()
-        else: st.warning("⚠️ Este resultado ya existe.")
     st.subheader("📋 Últimos Resultados")
-    if st.session_state.resultados:
+    registros = HISTORIAL.actual.registros
+    if registros:
         enc_cols=st.columns([2,2,1,1])
         enc_cols[0].write("**Fecha**"); enc_cols[1].write("**Franja**"); enc_cols[2].write("**Número**"); enc_cols[3].write("**Acción**")
         st.markdown("---")
-        for i in reversed(range(len(st.session_state.resultados))):
-            if len(st.session_state.resultados)-i > 10: break
-            resultado=st.session_state.resultados[i]
+        for i in reversed(range(len(registros))):
+            if len(registros)-i > 10: break
+            resultado=registros[i]
             row_cols=st.columns([2,2,1,1])
             row_cols[0].text(resultado["fecha"]); row_cols[1].text(resultado["franja"]); row_cols[2].text(resultado["numero"])
             if row_cols[3].button("❌", key=f"delete_button_{i}"):
-                del st.session_state.resultados[i]
-                guardar_datos(st.session_state.resultados)
+                HISTORIAL.borrar(i, resultado)
                 st.rerun()
     else: st.info("Aún no hay resultados para mostrar.")
 